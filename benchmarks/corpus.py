@@ -0,0 +1,114 @@
+"""
+Deterministic synthetic corpus of base images plus near-duplicate variants.
+
+    python -m benchmarks.corpus /tmp/corpus --bases 100
+
+A `camera_rate` fraction of the bases is camera sized (CAMERA_SIZE): full
+resolution decodes are where codec-dependent reduced decoding drifts, which
+the small bases don't show.
+"""
+import argparse
+import io
+import json
+import os
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+MANIFEST = "manifest.json"
+
+# name -> function(image) returning (image, save format, save options)
+VARIANTS = {
+    "jpeg95": lambda img: (img, "JPEG", {"quality": 95}),
+    "jpeg75": lambda img: (img, "JPEG", {"quality": 75}),
+    "jpeg50": lambda img: (img, "JPEG", {"quality": 50}),
+    "half": lambda img: (img.resize((img.width // 2, img.height // 2), Image.LANCZOS), "JPEG", {"quality": 90}),
+    "crop": lambda img: (img.crop((img.width // 40, img.height // 40,
+                                   img.width - img.width // 40, img.height - img.height // 40)),
+                         "JPEG", {"quality": 90}),
+    "bright": lambda img: (ImageEnhance.Brightness(img).enhance(1.05), "JPEG", {"quality": 90}),
+    "png": lambda img: (img, "PNG", {}),
+    "webp": lambda img: (img, "WEBP", {"quality": 85}),
+}
+
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+CAMERA_SIZE = (4000, 3000)
+
+
+def base_image(rng, size=(1024, 768)):
+    """A smooth random colour field with a few blocks, distinct per seed."""
+    coarse = rng.integers(0, 256, (rng.integers(4, 12), rng.integers(4, 12), 3), dtype=np.uint8)
+    img = Image.fromarray(coarse).resize(size, Image.BICUBIC)
+    pixels = np.asarray(img).copy()
+    for _ in range(rng.integers(2, 6)):
+        x, y = rng.integers(0, size[0] - 64), rng.integers(0, size[1] - 64)
+        w, h = rng.integers(32, size[0] // 3), rng.integers(32, size[1] // 3)
+        pixels[y:y + h, x:x + w] = rng.integers(0, 256, 3, dtype=np.uint8)
+    noise = rng.normal(0, 4, pixels.shape)
+    return Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+
+
+def generate(directory, bases=50, variants=tuple(VARIANTS), variant_rate=0.5, size=(1024, 768),
+             seed=0, camera_rate=0.2, camera_size=CAMERA_SIZE):
+    """
+    Write `bases` base images to `directory`, a `camera_rate` fraction of
+    them `camera_size` and the rest `size`; a `variant_rate` fraction of
+    them also gets one file per entry of `variants`. A manifest mapping every
+    file name to its base id (and every base id to its size) is written as
+    manifest.json and returned.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    # A separate stream, so the other draws don't depend on camera_rate.
+    size_rng = np.random.default_rng([seed, 1])
+    manifest = {"seed": seed, "bases": bases, "variants": list(variants), "camera_rate": camera_rate,
+                "files": {}, "base_sizes": []}
+
+    for base_id in range(bases):
+        base_size = camera_size if size_rng.random() < camera_rate else size
+        manifest["base_sizes"].append(list(base_size))
+        img = base_image(rng, base_size)
+        name = f"base{base_id:05d}.jpg"
+        img.save(os.path.join(directory, name), quality=92)
+        manifest["files"][name] = base_id
+
+        if rng.random() >= variant_rate:
+            continue
+        for variant in variants:
+            out, fmt, options = VARIANTS[variant](img)
+            name = f"base{base_id:05d}_{variant}{EXTENSIONS[fmt]}"
+            buffer = io.BytesIO()
+            out.save(buffer, fmt, **options)
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(buffer.getvalue())
+            manifest["files"][name] = base_id
+
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def load_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--bases", type=int, default=50)
+    parser.add_argument("--variant-rate", type=float, default=0.5)
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=sorted(VARIANTS))
+    parser.add_argument("--camera-rate", type=float, default=0.2,
+                        help=f"Fraction of bases at {CAMERA_SIZE[0]}x{CAMERA_SIZE[1]}")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = generate(args.directory, bases=args.bases, variants=args.variants,
+                        variant_rate=args.variant_rate, seed=args.seed, camera_rate=args.camera_rate)
+    print(f"Wrote {len(manifest['files'])} images to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
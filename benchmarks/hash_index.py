@@ -0,0 +1,96 @@
+"""
+Compare Hamming range-query latency of the hash indexes.
+
+    python -m benchmarks.hash_index --sizes 10000 100000 --distances 4 8 16 24
+    python -m benchmarks.hash_index --nearest 1 8 32
+"""
+import argparse
+import json
+import random
+import time
+
+from dedupe.structures import HASH_INDEXES
+
+
+def synthetic_hashes(count, bits=256, cluster=4, max_flips=12, seed=0):
+    """Random base hashes, each followed by `cluster - 1` near-duplicates."""
+    rng = random.Random(seed)
+    hashes = []
+    while len(hashes) < count:
+        base = rng.getrandbits(bits)
+        hashes.append(base)
+        for _ in range(cluster - 1):
+            variant = base
+            for _ in range(rng.randint(0, max_flips)):
+                variant ^= 1 << rng.randrange(bits)
+            hashes.append(variant)
+    return hashes[:count]
+
+
+def bench(kind, hashes, distances, queries, nearest=()):
+    index = HASH_INDEXES[kind]()
+    start = time.perf_counter()
+    for i, h in enumerate(hashes):
+        index.add(h, i)
+    build = time.perf_counter() - start
+
+    rows = []
+    for distance in distances:
+        found = 0
+        start = time.perf_counter()
+        for h in queries:
+            found += len(index.search(h, distance))
+        elapsed = time.perf_counter() - start
+        rows.append({
+            "index": kind,
+            "size": len(hashes),
+            "distance": distance,
+            "build_s": build,
+            "query_ms": elapsed / len(queries) * 1000.0,
+            "results": found,
+        })
+
+    for k in nearest:
+        start = time.perf_counter()
+        for h in queries:
+            index.nearest(h, k)
+        elapsed = time.perf_counter() - start
+        rows.append({
+            "index": kind,
+            "size": len(hashes),
+            "k": k,
+            "build_s": build,
+            "query_ms": elapsed / len(queries) * 1000.0,
+            "results": k * len(queries),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000])
+    parser.add_argument("--distances", type=int, nargs="+", default=[4, 8, 12, 16, 24])
+    parser.add_argument("--nearest", type=int, nargs="*", default=[], metavar="K",
+                        help="Also time k-nearest queries for these k")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--indexes", nargs="+", default=["bktree", "mih", "packed"],
+                        choices=sorted(HASH_INDEXES))
+    parser.add_argument("--json", action="store_true", help="Emit one JSON object per line")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        hashes = synthetic_hashes(size)
+        queries = random.Random(1).sample(hashes, min(args.queries, size))
+        for kind in args.indexes:
+            for row in bench(kind, hashes, args.distances, queries, args.nearest):
+                if args.json:
+                    print(json.dumps(row))
+                else:
+                    query = f"d={row['distance']:<3}" if "distance" in row else f"k={row['k']:<3}"
+                    print(f"{row['index']:>7} n={row['size']:<8} {query} "
+                          f"{row['query_ms']:9.3f} ms/query  (build {row['build_s']:.2f}s, "
+                          f"{row['results']} results)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Run every pipeline stage on a synthetic corpus and report throughput and accuracy.
+
+    python -m benchmarks.run --bases 200 --out results.json
+    python -m benchmarks.run --bases 200 --baseline results.json
+
+Recall is reported per variant kind, overall and per base resolution.
+Variants with no pairs found are warned about on stderr; with `--baseline`
+(an earlier report), so is every recall that dropped by more than
+`--max-recall-drop`, and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from itertools import combinations
+
+import numpy as np
+
+from dedupe.comparer import TierCounters, deep_similarity
+from dedupe.hashers import HASHERS, HASH_BITS
+from dedupe.indexer import build_index, load_image
+from dedupe.matcher import candidate_pairs, find_duplicate_groups
+from dedupe.structures import HASH_INDEXES
+
+from . import corpus
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def true_pairs(manifest):
+    by_base = {}
+    for name, base_id in manifest["files"].items():
+        by_base.setdefault(base_id, []).append(name)
+    return {tuple(sorted(pair)) for names in by_base.values() for pair in combinations(names, 2)}
+
+
+def found_pairs(groups):
+    pairs = set()
+    for group in groups:
+        names = sorted(os.path.basename(path) for path, _ in group)
+        pairs.update(combinations(names, 2))
+    return pairs
+
+
+def run(directory, manifest, threshold=95, hash_distance=5, size=64, tolerance=10,
+        index_kind="bktree", workers=1, tiered=True, samples=200, hasher="average", hash_bits=256):
+    stages = {}
+
+    start, cpu = time.perf_counter(), time.process_time()
+    index, tree, records, thumbs = build_index(directory, workers=workers, thumb_size=(size, size),
+                                               index_kind=index_kind, hasher=hasher, hash_bits=hash_bits)
+    elapsed = time.perf_counter() - start
+    stages["index"] = {
+        "seconds": elapsed,
+        "cpu_seconds": time.process_time() - cpu,
+        "images": len(records),
+        "images_per_sec": len(records) / elapsed if elapsed else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    start = time.perf_counter()
+    sizes = [len(tree.search(record.hash, threshold=hash_distance)) - 1 for record in records]
+    elapsed = time.perf_counter() - start
+    stages["search"] = {
+        "seconds": elapsed,
+        "queries_per_sec": len(records) / elapsed if elapsed else None,
+        "candidates_total": int(sum(sizes)),
+        "candidates_mean": float(np.mean(sizes)) if sizes else 0.0,
+        "candidates_max": int(max(sizes)) if sizes else 0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    pairs = list(candidate_pairs(tree, records, hash_distance))
+    stages["search"]["candidate_pairs"] = len(pairs)
+
+    sample = pairs[:samples]
+    start = time.perf_counter()
+    for i, j in sample:
+        img1 = load_image(records[i].path, target_size=(size, size))
+        img2 = load_image(records[j].path, target_size=(size, size))
+        if img1 is not None and img2 is not None:
+            deep_similarity(img1, img2, size=(size, size), tolerance=tolerance)
+        for img in (img1, img2):
+            if img is not None:
+                img.close()
+    elapsed = time.perf_counter() - start
+    stages["deep_similarity"] = {
+        "seconds": elapsed,
+        "pairs": len(sample),
+        "pairs_per_sec": len(sample) / elapsed if elapsed else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    counters = TierCounters()
+    start = time.perf_counter()
+    groups = find_duplicate_groups(records, tree, thumbs, threshold=threshold,
+                                   hash_distance=hash_distance, tolerance=tolerance,
+                                   tiered=tiered, counters=counters)
+    elapsed = time.perf_counter() - start
+    stages["find_duplicates"] = {
+        "seconds": elapsed,
+        "pairs_per_sec": len(pairs) / elapsed if elapsed else None,
+        "groups": len(groups),
+        "grouped_images": sum(len(group) for group in groups),
+        "compared_full": counters.full,
+        "rejected_coarse": sum(counters.rejected.values()),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    expected, found = true_pairs(manifest), found_pairs(groups)
+    hits = len(expected & found)
+    quality = {
+        "true_pairs": len(expected),
+        "found_pairs": len(found),
+        "precision": hits / len(found) if found else 1.0,
+        "recall": hits / len(expected) if expected else 1.0,
+    }
+
+    # Recall per variant kind shows which transformations the pipeline misses,
+    # and per resolution whether reduced decoding holds up on large images.
+    base_sizes = manifest.get("base_sizes")
+    missed = Counter()
+    total = Counter()
+    for a, b in expected:
+        kind = next((name.split("_", 1)[1].rsplit(".", 1)[0] for name in (a, b) if "_" in name), "base")
+        resolution = None
+        if base_sizes is not None:
+            resolution = "x".join(map(str, base_sizes[manifest["files"][a]]))
+        for key in ((None, kind), (resolution, kind)) if resolution else ((None, kind),):
+            total[key] += 1
+            if (a, b) not in found:
+                missed[key] += 1
+    recall = {key: 1 - missed[key] / total[key] for key in sorted(total, key=lambda k: (k[0] or "", k[1]))}
+    quality["recall_by_variant"] = {kind: value for (res, kind), value in recall.items() if res is None}
+    quality["recall_by_resolution"] = {}
+    for (res, kind), value in recall.items():
+        if res is not None:
+            quality["recall_by_resolution"].setdefault(res, {})[kind] = value
+
+    return {"stages": stages, "quality": quality}
+
+
+def recall_table(quality):
+    """`{(resolution or "all", variant): recall}` of a report's quality section."""
+    table = {("all", kind): value for kind, value in quality["recall_by_variant"].items()}
+    for res, kinds in quality.get("recall_by_resolution", {}).items():
+        table.update(((res, kind), value) for kind, value in kinds.items())
+    return table
+
+
+def compare_recall(quality, baseline, max_drop=0.02):
+    """
+    Per-variant recall of `quality` against the `baseline` report's quality
+    section: returns `(rows, regressions)`, where each row is
+    `{"resolution", "variant", "baseline", "current", "delta"}`.
+    """
+    current, before = recall_table(quality), recall_table(baseline)
+    rows = [{"resolution": res, "variant": kind, "baseline": before.get((res, kind)),
+             "current": value,
+             "delta": value - before[(res, kind)] if (res, kind) in before else None}
+            for (res, kind), value in sorted(current.items())]
+    regressions = [row for row in rows if row["delta"] is not None and row["delta"] < -max_drop]
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", help="Existing corpus directory (generated if missing)")
+    parser.add_argument("--bases", type=int, default=100)
+    parser.add_argument("--variant-rate", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold", type=int, default=95)
+    parser.add_argument("--hash-distance", type=int, default=5)
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--tolerance", type=int, default=10)
+    parser.add_argument("--hash-index", choices=sorted(HASH_INDEXES), default="bktree")
+    parser.add_argument("--hasher", choices=sorted(HASHERS), default="average")
+    parser.add_argument("--hash-bits", type=int, choices=HASH_BITS, default=256)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--no-early-reject", action="store_true")
+    parser.add_argument("--camera-rate", type=float, default=0.2,
+                        help="Fraction of camera-resolution bases in a generated corpus")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare per-variant recall with")
+    parser.add_argument("--max-recall-drop", type=float, default=0.02)
+    parser.add_argument("--out", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    directory = args.corpus
+    temporary = None
+    if directory is None:
+        temporary = directory = tempfile.mkdtemp(prefix="photo_dedup_bench_")
+    if not os.path.exists(os.path.join(directory, corpus.MANIFEST)):
+        corpus.generate(directory, bases=args.bases, variant_rate=args.variant_rate, seed=args.seed,
+                        camera_rate=args.camera_rate)
+    manifest = corpus.load_manifest(directory)
+
+    params = {
+        "threshold": args.threshold,
+        "hash_distance": args.hash_distance,
+        "size": args.size,
+        "tolerance": args.tolerance,
+        "index_kind": args.hash_index,
+        "hasher": args.hasher,
+        "hash_bits": args.hash_bits,
+        "workers": args.workers,
+        "tiered": not args.no_early_reject,
+    }
+    try:
+        report = run(directory, manifest, **params)
+    finally:
+        if temporary is not None:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    report = {
+        "params": params,
+        "corpus": {
+            "seed": manifest["seed"],
+            "bases": manifest["bases"],
+            "variants": manifest["variants"],
+            "camera_rate": manifest.get("camera_rate", 0.0),
+            "files": len(manifest["files"]),
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        **report,
+    }
+
+    for (res, kind), value in sorted(recall_table(report["quality"]).items()):
+        if value == 0.0:
+            print(f"warning: no {kind} pairs found ({res} bases)", file=sys.stderr)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["baseline"], regressions = compare_recall(report["quality"], baseline["quality"],
+                                                         args.max_recall_drop)
+        for row in regressions:
+            print(f"warning: {row['variant']} recall ({row['resolution']} bases) dropped from "
+                  f"{row['baseline']:.3f} to {row['current']:.3f}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,3 @@
-from .commands import find_duplicates
+from .commands import find_duplicates, iter_duplicates, serve, watch, DuplicateImage, OUTPUT_FORMATS
 
-__all__ = ['main', 'find_duplicates']
+__all__ = ['main', 'find_duplicates', 'iter_duplicates', 'serve', 'watch', 'DuplicateImage', 'OUTPUT_FORMATS']
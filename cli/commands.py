@@ -1,9 +1,170 @@
+import csv
+import json
+import os
+import sys
+from collections import namedtuple
+from contextlib import redirect_stdout
 from pathlib import Path
 from PIL import Image
-from dedupe.indexer import build_index, load_image
-from dedupe.comparer import deep_similarity
+from dedupe.indexer import MAX_IMAGE_PIXELS
+from dedupe.comparer import TierCounters
+from dedupe.cache import HashCache
+from dedupe.engine import ScanEngine
+from dedupe.service import DuplicateIndex, make_server
+from dedupe.watch import Watcher
+from dedupe import profiling
 
-def find_duplicates(directory, threshold=95, hash_distance=5, size=64, tolerance=10, verbose=False):
+OUTPUT_FORMATS = ('text', 'jsonl', 'csv')
+
+DuplicateImage = namedtuple("DuplicateImage", ["path", "similarity", "hash", "size"])
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def iter_duplicates(directory, threshold=95, hash_distance=5, size=64, tolerance=10, verbose=False,
+                    cache_path=None, workers=1, max_pixels=MAX_IMAGE_PIXELS, tiered=True,
+                    index_kind='bktree', scan_options=None, exact_first=False, prefetch_mb=0,
+                    counters=None, checkpoint_path=None, resume=False, max_candidates=None,
+                    index_path=None, rebuild_index=False, hasher='average', hash_bits=256):
+    """
+    Index `directory` and yield each duplicate group as soon as it is final.
+
+    Takes the same arguments as `find_duplicates`. Each group is a list of
+    `DuplicateImage(path, similarity, hash, size)`; `hash` is the image's
+    perceptual hash as an int and `size` its file size in bytes (None if the file
+    vanished). Only the current group is held, so memory does not grow with
+    the number of groups found.
+    """
+    if verbose:
+        print(f"Scanning directory: {directory}")
+    
+    def report_progress(stage, done, total):
+        if not verbose or stage != 'match':
+            return
+        if done == 0:
+            print(f"\nSearching for duplicates (threshold: {threshold}%, tolerance: {tolerance})...")
+        else:
+            print(f"  Processed {done}/{total} images...")
+    
+    engine = ScanEngine(progress=report_progress, interval=1.0, counters=counters)
+    groups = engine.iter_groups(
+        directory,
+        threshold=threshold,
+        hash_distance=hash_distance,
+        size=size,
+        tolerance=tolerance,
+        cache_path=cache_path,
+        workers=workers,
+        max_pixels=max_pixels,
+        tiered=tiered,
+        index_kind=index_kind,
+        scan_options=scan_options,
+        exact_first=exact_first,
+        prefetch_bytes=int(prefetch_mb * 1024 * 1024),
+        verbose=verbose,
+        details=True,
+        checkpoint_path=checkpoint_path,
+        resume=resume,
+        max_candidates=max_candidates,
+        index_path=index_path,
+        rebuild_index=rebuild_index,
+        hasher=hasher,
+        hash_bits=hash_bits
+    )
+    for group in groups:
+        # Byte-identical copies come with their representative's record and hash.
+        yield [DuplicateImage(path, similarity, record.hash, _file_size(path))
+               for path, similarity, record in group]
+    
+    if engine.records is not None and len(engine.records) == 0 and not engine.stopped:
+        print("No images found in directory.")
+
+
+class _TextWriter:
+    """The human-readable report; needs every group before it can print the header."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.groups = []
+
+    def write(self, group):
+        self.groups.append(group)
+
+    def close(self):
+        out = self.stream
+        out.write("\n" + "="*70 + "\n")
+        if self.groups:
+            out.write(f"Found {len(self.groups)} duplicate group(s):\n\n")
+            
+            for idx, group in enumerate(self.groups, 1):
+                out.write(f"Group {idx} ({len(group)} images):\n")
+                for image in group:
+                    out.write(f"  [{image.similarity:5.2f}%] {image.path}\n")
+                out.write("\n")
+        else:
+            out.write("No duplicates found.\n")
+        out.write("="*70 + "\n")
+        out.flush()
+        return self.groups
+
+
+class _JsonLinesWriter:
+    """One JSON object per group, flushed as soon as the group is final."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def write(self, group):
+        self.count += 1
+        self.stream.write(json.dumps({
+            "group": self.count,
+            "images": [
+                {"path": image.path, "similarity": round(image.similarity, 2),
+                 "hash": format(image.hash, "x"), "size": image.size}
+                for image in group
+            ],
+        }) + "\n")
+        self.stream.flush()
+
+    def close(self):
+        return self.count
+
+
+class _CsvWriter:
+    """One row per image, tagged with its group number, flushed per group."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = csv.writer(stream)
+        self.writer.writerow(["group", "path", "similarity", "hash", "size"])
+        self.count = 0
+
+    def write(self, group):
+        self.count += 1
+        for image in group:
+            self.writer.writerow([self.count, image.path, f"{image.similarity:.2f}",
+                                  format(image.hash, "x"), "" if image.size is None else image.size])
+        self.stream.flush()
+
+    def close(self):
+        return self.count
+
+
+_WRITERS = {'text': _TextWriter, 'jsonl': _JsonLinesWriter, 'csv': _CsvWriter}
+
+
+def find_duplicates(directory, threshold=95, hash_distance=5, size=64, tolerance=10, verbose=False,
+                    cache_path=None, workers=1, max_pixels=MAX_IMAGE_PIXELS, tiered=True,
+                    index_kind='bktree', scan_options=None, exact_first=False, profile_path=None,
+                    output_format='text', output=None, prefetch_mb=0, checkpoint_path=None,
+                    resume=False, max_candidates=None, index_path=None, rebuild_index=False,
+                    hasher='average', hash_bits=256):
     """
     Find all duplicate images within a directory.
     
@@ -11,79 +172,238 @@ def find_duplicates(directory, threshold=95, hash_distance=5, size=64, tolerance
         directory: Path to folder containing images to search
         threshold: Similarity percentage threshold (0-100)
         hash_distance: Maximum hamming distance for hash-based filtering
+            (at most `hash_bits`)
+        hasher: Perceptual hash, 'average', 'difference' or 'dct' (see
+            `dedupe.hashers.HASHERS`)
+        hash_bits: Hash length in bits, 64, 256 or 1024
         size: Size to resize images for comparison (NxN)
         tolerance: Grayscale pixel tolerance (0-255)
         verbose: Show detailed progress
+        cache_path: Hash cache file to reuse between runs (None disables caching)
+        max_candidates: Compare each image with at most this many of its
+            nearest hashes within `hash_distance` (None compares all), which
+            bounds the work on dense clusters such as burst shots
+        workers: Number of processes used for hashing (0 = one per CPU)
+        max_pixels: Skip images that would decode to more pixels than this
+        tiered: Reject clear non-matches on low-resolution levels before the
+            full-size comparison (same results, less work)
+        index_kind: Hash search structure, 'bktree', 'packed' or 'mih'
+        scan_options: Keyword arguments for `dedupe.indexer.iter_images`
+            (recursive, extensions, include, exclude, follow_symlinks)
+        exact_first: Group byte-identical files before decoding and only
+            hash one file per identical set
+        prefetch_mb: Read files to decode this many MiB ahead on background
+            threads, hiding latency on network filesystems (0 disables)
+        profile_path: Write a JSON report of per-stage timings and counters here
+        index_path: Index snapshot file: loaded instead of scanning if it was
+            built with the same settings, otherwise built and written
+        rebuild_index: Rescan and rewrite `index_path` even if it is usable
+        checkpoint_path: Save the scan's progress to this file every 30
+            seconds, so an interrupted scan can be resumed
+        resume: Continue from the checkpoint at `checkpoint_path` if it was
+            left by a scan of the same files with the same settings; the
+            groups it had found are reported along with the new ones
+        output_format: 'text' prints a report once the scan is done; 'jsonl'
+            and 'csv' write each group the moment it is final and flush
+        output: File path or text stream for the results (default: stdout).
+            Progress messages go to stderr when machine-readable results go
+            to stdout.
+    
+    Returns:
+        The list of groups (see `iter_duplicates`) for 'text', or the number
+        of groups written for 'jsonl' and 'csv', which are not kept in memory
+    """
+    if output_format not in _WRITERS:
+        raise ValueError(f"Unknown output format {output_format!r}; expected one of {OUTPUT_FORMATS}")
+    
+    stream = sys.stdout if output is None else output
+    opened = not hasattr(stream, "write")
+    if opened:
+        stream = open(output, "w", newline="" if output_format == 'csv' else None)
+    # Keep the result stream parseable by sending chatter to stderr.
+    quiet = output_format != 'text' and stream is sys.stdout
+    
+    profile = profiling.enable() if profile_path is not None else None
+    try:
+        with profiling.stage("total"), redirect_stdout(sys.stderr if quiet else sys.stdout):
+            counters = TierCounters()
+            writer = _WRITERS[output_format](stream)
+            groups = iter_duplicates(
+                directory,
+                threshold=threshold,
+                hash_distance=hash_distance,
+                size=size,
+                tolerance=tolerance,
+                verbose=verbose,
+                cache_path=cache_path,
+                workers=workers,
+                max_pixels=max_pixels,
+                tiered=tiered,
+                index_kind=index_kind,
+                scan_options=scan_options,
+                exact_first=exact_first,
+                prefetch_mb=prefetch_mb,
+                counters=counters,
+                checkpoint_path=checkpoint_path,
+                resume=resume,
+                max_candidates=max_candidates,
+                index_path=index_path,
+                rebuild_index=rebuild_index,
+                hasher=hasher,
+                hash_bits=hash_bits,
+            )
+            for group in groups:
+                writer.write(group)
+            
+            if verbose and counters.candidates:
+                print(counters.summary())
+            return writer.close()
+    finally:
+        if opened:
+            stream.close()
+        if profile is not None:
+            profiling.disable()
+            profile.dump(profile_path, params=dict(
+                directory=str(directory),
+                threshold=threshold,
+                hash_distance=hash_distance,
+                size=size,
+                tolerance=tolerance,
+                workers=workers,
+                tiered=tiered,
+                index_kind=index_kind,
+                exact_first=exact_first,
+                prefetch_mb=prefetch_mb,
+                max_candidates=max_candidates,
+                hasher=hasher,
+                hash_bits=hash_bits,
+            ))
+            if verbose:
+                print(f"Profile written to {profile_path}")
+
+
+def serve(directory, host="127.0.0.1", port=8765, threshold=95, hash_distance=5, size=64, tolerance=10,
+          verbose=False, cache_path=None, workers=1, max_pixels=MAX_IMAGE_PIXELS, index_kind='bktree',
+          scan_options=None, exact_first=False, prefetch_mb=0, hasher='average', hash_bits=256):
+    """
+    Index `directory` once and answer near-duplicate queries over HTTP until
+    interrupted (see `dedupe.service` for the endpoints). `threshold`,
+    `hash_distance` and `tolerance` are the defaults for queries that
+    don't set them; the other arguments are as for `find_duplicates`.
     """
     if verbose:
         print(f"Scanning directory: {directory}")
     
-    index, tree, records = build_index(directory, verbose=verbose)
+    index_options = dict(
+        size=size,
+        threshold=threshold,
+        hash_distance=hash_distance,
+        tolerance=tolerance,
+        verbose=verbose,
+        workers=workers,
+        max_pixels=max_pixels,
+        index_kind=index_kind,
+        scan_options=scan_options,
+        exact_first=exact_first,
+        prefetch_bytes=int(prefetch_mb * 1024 * 1024),
+        hasher=hasher,
+        hash_bits=hash_bits,
+    )
+    if cache_path is not None:
+        with HashCache(cache_path) as cache:
+            index = DuplicateIndex.build(directory, cache=cache, **index_options)
+    else:
+        index = DuplicateIndex.build(directory, **index_options)
     
-    if len(records) == 0:
-        print("No images found in directory.")
-        return
+    server = make_server(index, host, port)
+    print(f"Serving {len(index)} images on http://{host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def watch(directory, threshold=95, hash_distance=5, size=64, tolerance=10, verbose=False,
+          cache_path=None, workers=1, max_pixels=MAX_IMAGE_PIXELS, index_kind='bktree',
+          scan_options=None, exact_first=False, prefetch_mb=0, output_format='text', output=None,
+          settle=0.25, poll_interval=1.0, should_stop=None, hasher='average', hash_bits=256):
+    """
+    Index `directory` once, then check every image that appears or changes
+    in it against the index as soon as it has finished being written,
+    report its matches and add it. Deleted images are dropped from the
+    index. Runs until interrupted or `should_stop()` returns True.
     
-    if verbose:
-        print(f"\nSearching for duplicates (threshold: {threshold}%, tolerance: {tolerance})...")
+    Uses inotify on Linux and polls every `poll_interval` seconds
+    elsewhere; a file must be unchanged for `settle` seconds before it is
+    hashed. 'text' prints one line per match, 'jsonl' one object per
+    checked file (`{"path", "matches"}`); see `find_duplicates` for the
+    other arguments.
+    """
+    if output_format not in ('text', 'jsonl'):
+        raise ValueError(f"Watch mode writes 'text' or 'jsonl', not {output_format!r}")
     
-    duplicate_groups = []
-    processed = set()
-    comparison_size = (size, size)
+    stream = sys.stdout if output is None else output
+    opened = not hasattr(stream, "write")
+    if opened:
+        stream = open(output, "a")
+    quiet = output_format != 'text' and stream is sys.stdout
     
-    for i, record in enumerate(records):
-        if record.path in processed:
-            continue
-        
-        if verbose and (i + 1) % 50 == 0:
-            print(f"  Processed {i + 1}/{len(records)} images...")
-        
-        candidates = tree.search(record.hash, threshold=hash_distance)
-        
-        img1 = load_image(record.path)
-        if img1 is None:
-            continue
-        
-        group = []
-        
-        for candidate in candidates:
-            if candidate.path == record.path or candidate.path in processed:
-                continue
-            
-            img2 = load_image(candidate.path)
-            if img2 is None:
-                continue
+    # Watch first so nothing written while the index is built is missed.
+    watcher = Watcher(directory, settle=settle, poll_interval=poll_interval, **(scan_options or {}))
+    watcher.start()
+    try:
+        with redirect_stdout(sys.stderr if quiet else sys.stdout):
+            if verbose:
+                print(f"Scanning directory: {directory}")
             
-            similarity = deep_similarity(
-                img1, 
-                img2, 
-                size=comparison_size, 
-                tolerance=tolerance
+            index_options = dict(
+                size=size,
+                threshold=threshold,
+                hash_distance=hash_distance,
+                tolerance=tolerance,
+                verbose=verbose,
+                workers=workers,
+                max_pixels=max_pixels,
+                index_kind=index_kind,
+                scan_options=scan_options,
+                exact_first=exact_first,
+                prefetch_bytes=int(prefetch_mb * 1024 * 1024),
+                hasher=hasher,
+                hash_bits=hash_bits,
             )
+            if cache_path is not None:
+                with HashCache(cache_path) as cache:
+                    index = DuplicateIndex.build(directory, cache=cache, **index_options)
+            else:
+                index = DuplicateIndex.build(directory, **index_options)
+            print(f"Watching {directory} ({len(index)} images indexed, {watcher.mode})", flush=True)
             
-            img2.close()
-            
-            if similarity >= threshold:
-                if not group:
-                    group.append((record.path, 100.0))
-                group.append((candidate.path, similarity))
-                processed.add(candidate.path)
-        
-        img1.close()
-        
-        if group:
-            processed.add(record.path)
-            duplicate_groups.append(group)
-    
-    print("\n" + "="*70)
-    if duplicate_groups:
-        print(f"Found {len(duplicate_groups)} duplicate group(s):\n")
-        
-        for idx, group in enumerate(duplicate_groups, 1):
-            print(f"Group {idx} ({len(group)} images):")
-            for path, similarity in group:
-                print(f"  [{similarity:5.2f}%] {path}")
-            print()
-    else:
-        print("No duplicates found.")
-    print("="*70)
+            for event, path in watcher.events(should_stop=should_stop):
+                if event == 'removed':
+                    index.remove(path)
+                    if verbose:
+                        print(f"  Removed: {path}")
+                    continue
+                try:
+                    matches = index.query_insert(path)
+                except ValueError:
+                    if verbose:
+                        print(f"  Skipped (load failed): {path}")
+                    continue
+                
+                if output_format == 'jsonl':
+                    stream.write(json.dumps({"path": path, "matches": matches}) + "\n")
+                elif matches:
+                    for match in matches:
+                        stream.write(f"[{match['similarity']:5.2f}%] {path} ~ {match['path']}\n")
+                elif verbose:
+                    stream.write(f"[  new  ] {path}\n")
+                stream.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if opened:
+            stream.close()
@@ -1,5 +1,11 @@
 import argparse
-from .commands import find_duplicates
+import sys
+from .commands import find_duplicates, serve, watch, OUTPUT_FORMATS
+from dedupe.cache import default_cache_path
+from dedupe.checkpoint import default_checkpoint_path
+from dedupe.hashers import HASHERS, HASH_BITS
+from dedupe.indexer import MAX_IMAGE_PIXELS, VALID_EXT
+from dedupe.structures import HASH_INDEXES
 
 def main():
     parser = argparse.ArgumentParser(
@@ -10,11 +16,42 @@ Examples:
   # Find all duplicates in photos/ folder
   python -m yourpackage.main --dir photos/
   
+  # Include subfolders, skipping thumbnail caches
+  python -m yourpackage.main --dir photos/ -r --exclude ".thumbnails"
+  
   # Use stricter matching (95% similarity required)
   python -m yourpackage.main --dir photos/ --threshold 95
   
   # More lenient pixel tolerance
   python -m yourpackage.main --dir photos/ --tolerance 20
+  
+  # Reuse hashes from previous runs (only new/changed files are decoded)
+  python -m yourpackage.main --dir photos/ --cache
+  
+  # Use a DCT (pHash) 64-bit hash, more robust to recompression and resizing
+  python -m yourpackage.main --dir photos/ --hasher dct --hash-bits 64 --hash-distance 8
+  
+  # Search a wide hash radius but verify only the 8 closest images per photo
+  python -m yourpackage.main --dir bursts/ --hash-distance 30 --max-candidates 8
+  
+  # Save the index once, then reload it in milliseconds on later runs
+  python -m yourpackage.main --dir archive/ -r --index archive.idx
+  
+  # Continue a long scan that was interrupted (Ctrl-C, crash) where it stopped;
+  # scans save their progress every 30 seconds unless --no-checkpoint is given
+  python -m yourpackage.main --dir archive/ -r --resume
+  
+  # Hash on every CPU core
+  python -m yourpackage.main --dir photos/ --workers 0
+  
+  # Stream one JSON object per group into a file as groups are found
+  python -m yourpackage.main --dir photos/ --format jsonl --output groups.jsonl
+  
+  # Report near-duplicates of new files as they land in an ingest folder
+  python -m yourpackage.main --dir incoming/ -r --watch
+  
+  # Keep the library indexed and answer queries for new photos over HTTP
+  python -m yourpackage.main --dir photos/ --cache --serve 127.0.0.1:8765
         """
     )
 
@@ -24,6 +61,48 @@ Examples:
         help="Directory containing images to scan for duplicates"
     )
 
+    parser.add_argument(
+        "--recursive",
+        "-r",
+        action="store_true",
+        help="Also scan subdirectories"
+    )
+
+    parser.add_argument(
+        "--include",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="Only scan files whose relative path or name matches GLOB (repeatable)"
+    )
+
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="Skip files and directories whose relative path or name matches GLOB (repeatable)"
+    )
+
+    parser.add_argument(
+        "--extensions",
+        default=",".join(VALID_EXT),
+        help=f"Comma-separated file extensions to scan (default: {','.join(VALID_EXT)})"
+    )
+
+    parser.add_argument(
+        "--follow-symlinks",
+        action="store_true",
+        help="Follow symlinked files and directories (skipped by default)"
+    )
+
+    parser.add_argument(
+        "--exact-first",
+        action="store_true",
+        help="Group byte-identical files (size, then partial and full digests) before "
+             "decoding, so only one copy of each is hashed and compared"
+    )
+
     parser.add_argument(
         "--threshold",
         type=int,
@@ -38,6 +117,15 @@ Examples:
         help="Maximum hash distance for initial filtering (default: 5, lower=stricter)"
     )
 
+    parser.add_argument(
+        "--max-candidates",
+        type=int,
+        default=None,
+        metavar="K",
+        help="Compare each image with at most its K nearest hashes within --hash-distance, "
+             "bounding the work on dense clusters such as burst shots (default: all)"
+    )
+
     parser.add_argument(
         "--size",
         type=int,
@@ -52,6 +140,149 @@ Examples:
         help="Pixel grayscale tolerance (0-255, default: 10, lower=stricter)"
     )
 
+    parser.add_argument(
+        "--cache",
+        nargs="?",
+        const=default_cache_path(),
+        default=None,
+        metavar="FILE",
+        help=f"Cache hashes and memory-mapped comparison thumbnails between runs, keyed on "
+             f"path, size and mtime (default file: {default_cache_path()})"
+    )
+
+    parser.add_argument(
+        "--index",
+        metavar="FILE",
+        help="Load the index from this snapshot instead of scanning (built and saved there "
+             "on the first run or when settings differ; changed files are not noticed)"
+    )
+
+    parser.add_argument(
+        "--rebuild-index",
+        action="store_true",
+        help="Rescan the directory and rewrite the --index snapshot"
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        metavar="FILE",
+        help="Save the scan's progress to FILE every 30 seconds so it can be resumed "
+             "(default: a file per directory, next to the default hash cache)"
+    )
+
+    parser.add_argument(
+        "--no-checkpoint",
+        action="store_true",
+        help="Do not save the scan's progress (the scan cannot be resumed)"
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted scan from its checkpoint (--checkpoint FILE, or the default "
+             "file for the directory); starts over if the files or settings changed"
+    )
+
+    parser.add_argument(
+        "--hasher",
+        choices=sorted(HASHERS),
+        default="average",
+        help="Perceptual hash used to find candidates: 'average' (brighter than the mean), "
+             "'difference' (brighter than the right neighbour) or 'dct' (pHash) (default: average)"
+    )
+
+    parser.add_argument(
+        "--hash-bits",
+        type=int,
+        choices=HASH_BITS,
+        default=256,
+        help="Length of the perceptual hash in bits (default: 256)"
+    )
+
+    parser.add_argument(
+        "--hash-index",
+        choices=sorted(HASH_INDEXES),
+        default="bktree",
+        help="Structure used to find hash candidates: 'bktree' walks a BK-tree, "
+             "'packed' scans a dense uint64 array with vectorized XOR/popcount, "
+             "'mih' uses multi-index hashing (default: bktree)"
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used for hashing (default: 1, 0 = one per CPU)"
+    )
+
+    parser.add_argument(
+        "--prefetch-mb",
+        type=float,
+        default=0,
+        metavar="MB",
+        help="Read files this many MiB ahead of decoding on background threads; "
+             "speeds up network filesystems (default: 0, disabled)"
+    )
+
+    parser.add_argument(
+        "--max-megapixels",
+        type=float,
+        default=MAX_IMAGE_PIXELS / 1_000_000,
+        help=f"Skip images that would decode to more than this many megapixels "
+             f"(default: {MAX_IMAGE_PIXELS // 1_000_000})"
+    )
+
+    parser.add_argument(
+        "--no-early-reject",
+        action="store_true",
+        help="Compare every candidate at full size instead of rejecting clear "
+             "non-matches at low resolution first (results are identical)"
+    )
+
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Write per-stage wall/CPU times and counters as JSON to FILE"
+    )
+
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="text",
+        help="Result format: 'text' prints a report at the end, 'jsonl' and 'csv' "
+             "write each group (paths, hashes, similarity, file sizes) as soon as "
+             "it is found (default: text)"
+    )
+
+    parser.add_argument(
+        "--output",
+        "-o",
+        metavar="FILE",
+        help="Write results to FILE instead of stdout"
+    )
+
+    parser.add_argument(
+        "--serve",
+        metavar="[HOST:]PORT",
+        help="Index --dir once, then answer near-duplicate queries and inserts/removals "
+             "over HTTP instead of reporting duplicates (see dedupe.service)"
+    )
+
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Index --dir once, then check each new or modified image against it as soon "
+             "as it is fully written (inotify, or polling where unavailable)"
+    )
+
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=0.25,
+        metavar="SECONDS",
+        help="With --watch, how long a file must stay unchanged before it is checked (default: 0.25)"
+    )
+
     parser.add_argument(
         "--verbose",
         "-v",
@@ -71,17 +302,133 @@ Examples:
     if args.size < 8 or args.size > 512:
         parser.error("Size must be between 8 and 512")
     
-    if args.hash_distance < 0 or args.hash_distance > 64:
-        parser.error("Hash distance must be between 0 and 64")
+    if args.hash_distance < 0 or args.hash_distance > args.hash_bits:
+        parser.error(f"Hash distance must be between 0 and {args.hash_bits}")
+    
+    if args.no_checkpoint and (args.resume or args.checkpoint):
+        parser.error("--no-checkpoint cannot be combined with --checkpoint or --resume")
+
+    if args.max_candidates is not None and args.max_candidates < 1:
+        parser.error("Max candidates must be 1 or greater")
+
+    if args.rebuild_index and args.index is None:
+        parser.error("--rebuild-index needs --index FILE")
+
+    if args.workers < 0:
+        parser.error("Workers must be 0 or greater")
+
+    if args.prefetch_mb < 0:
+        parser.error("Prefetch budget must be 0 or greater")
+
+    if args.max_megapixels <= 0:
+        parser.error("Max megapixels must be greater than 0")
 
-    find_duplicates(
-        directory=args.dir,
-        threshold=args.threshold,
-        hash_distance=args.hash_distance,
-        size=args.size,
-        tolerance=args.tolerance,
-        verbose=args.verbose
+    extensions = tuple(
+        ext if ext.startswith(".") else "." + ext
+        for ext in (e.strip().lower() for e in args.extensions.split(","))
+        if ext
     )
+    if not extensions:
+        parser.error("At least one extension is required")
+
+    scan_options = dict(
+        recursive=args.recursive,
+        extensions=extensions,
+        include=args.include,
+        exclude=args.exclude,
+        follow_symlinks=args.follow_symlinks,
+    )
+
+    if args.serve and args.watch:
+        parser.error("--serve and --watch can't be combined")
+
+    if args.watch:
+        if args.format == "csv":
+            parser.error("--watch writes text or jsonl")
+        watch(
+            directory=args.dir,
+            threshold=args.threshold,
+            hash_distance=args.hash_distance,
+            size=args.size,
+            tolerance=args.tolerance,
+            verbose=args.verbose,
+            cache_path=args.cache,
+            workers=args.workers,
+            max_pixels=int(args.max_megapixels * 1_000_000),
+            index_kind=args.hash_index,
+            scan_options=scan_options,
+            exact_first=args.exact_first,
+            prefetch_mb=args.prefetch_mb,
+            output_format=args.format,
+            output=args.output,
+            settle=args.settle,
+            hasher=args.hasher,
+            hash_bits=args.hash_bits
+        )
+        return
+
+    if args.serve:
+        host, _, port = args.serve.rpartition(":")
+        if not port.isdigit():
+            parser.error("--serve expects [HOST:]PORT")
+        serve(
+            directory=args.dir,
+            host=host or "127.0.0.1",
+            port=int(port),
+            threshold=args.threshold,
+            hash_distance=args.hash_distance,
+            size=args.size,
+            tolerance=args.tolerance,
+            verbose=args.verbose,
+            cache_path=args.cache,
+            workers=args.workers,
+            max_pixels=int(args.max_megapixels * 1_000_000),
+            index_kind=args.hash_index,
+            scan_options=scan_options,
+            exact_first=args.exact_first,
+            prefetch_mb=args.prefetch_mb,
+            hasher=args.hasher,
+            hash_bits=args.hash_bits
+        )
+        return
+
+    checkpoint_path = None
+    if not args.no_checkpoint:
+        checkpoint_path = args.checkpoint or default_checkpoint_path(args.dir)
+
+    try:
+        find_duplicates(
+            directory=args.dir,
+            threshold=args.threshold,
+            hash_distance=args.hash_distance,
+            size=args.size,
+            tolerance=args.tolerance,
+            verbose=args.verbose,
+            cache_path=args.cache,
+            workers=args.workers,
+            max_pixels=int(args.max_megapixels * 1_000_000),
+            tiered=not args.no_early_reject,
+            index_kind=args.hash_index,
+            scan_options=scan_options,
+            exact_first=args.exact_first,
+            prefetch_mb=args.prefetch_mb,
+            profile_path=args.profile,
+            output_format=args.format,
+            output=args.output,
+            checkpoint_path=checkpoint_path,
+            resume=args.resume,
+            max_candidates=args.max_candidates,
+            index_path=args.index,
+            rebuild_index=args.rebuild_index,
+            hasher=args.hasher,
+            hash_bits=args.hash_bits
+        )
+    except KeyboardInterrupt:
+        if checkpoint_path is None:
+            raise
+        print(f"\nInterrupted; progress is saved in {checkpoint_path}, run again with --resume "
+              f"to continue", file=sys.stderr)
+        sys.exit(130)
 
 if __name__ == "__main__":
     main()
@@ -1,15 +1,80 @@
-from .hashers import tiny_hash
-from .structures import HashTable, BKTree
-from .indexer import build_index, ImageRecord, scan_folder, load_image
-from .comparer import deep_similarity
+from .hashers import tiny_hash, get_hasher, Hasher, AverageHash, DifferenceHash, DCTHash, HASHERS
+from .structures import (HashTable, BKTree, FrozenBKTree, PackedHashIndex, MultiIndexHash, UnionFind,
+                         HASH_INDEXES)
+from .indexer import (
+    build_index,
+    ImageRecord,
+    scan_folder,
+    iter_images,
+    load_image,
+    hash_entries,
+    hash_files,
+)
+from .comparer import (
+    deep_similarity,
+    array_similarity,
+    batch_similarity,
+    pair_similarity,
+    grayscale_thumbnail,
+    build_pyramid,
+    tiered_similarity,
+    TierCounters,
+)
+from .records import RecordStore, RecordView
+from .thumbstore import ThumbnailStore
+from .cache import HashCache
+from .exact import find_exact_duplicates
+from .matcher import candidate_pairs, iter_duplicate_groups, find_duplicate_groups
+from .checkpoint import ScanCheckpoint
+from .snapshot import save_index, load_index
+from .engine import ScanEngine
+from .service import DuplicateIndex, QueryClient, make_server
+from .watch import Watcher
 
 __all__ = [
     'tiny_hash',
+    'get_hasher',
+    'Hasher',
+    'AverageHash',
+    'DifferenceHash',
+    'DCTHash',
+    'HASHERS',
     'HashTable',
     'BKTree',
+    'FrozenBKTree',
+    'PackedHashIndex',
+    'MultiIndexHash',
+    'UnionFind',
+    'HASH_INDEXES',
     'build_index',
     'ImageRecord',
     'scan_folder',
+    'iter_images',
     'load_image',
+    'hash_entries',
+    'hash_files',
     'deep_similarity',
+    'array_similarity',
+    'batch_similarity',
+    'pair_similarity',
+    'grayscale_thumbnail',
+    'build_pyramid',
+    'tiered_similarity',
+    'TierCounters',
+    'RecordStore',
+    'RecordView',
+    'ThumbnailStore',
+    'HashCache',
+    'find_exact_duplicates',
+    'candidate_pairs',
+    'iter_duplicate_groups',
+    'find_duplicate_groups',
+    'ScanCheckpoint',
+    'save_index',
+    'load_index',
+    'ScanEngine',
+    'DuplicateIndex',
+    'QueryClient',
+    'make_server',
+    'Watcher',
 ]
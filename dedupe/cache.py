@@ -0,0 +1,227 @@
+import os
+import sqlite3
+from pathlib import Path
+import numpy as np
+from .thumbstore import ThumbnailStore
+
+# Bump whenever hashing or decoding changes so old entries are discarded.
+CACHE_VERSION = 7
+
+DEFAULT_HASHER = "average-256@16x16"
+
+
+def default_cache_path():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(Path.home(), ".cache")
+    return os.path.join(base, "photo_dedup", "hashes.sqlite3")
+
+
+def _pack_hash(hash_value):
+    return hash_value.to_bytes((hash_value.bit_length() + 7) // 8 or 1, "big")
+
+
+def _unpack_hash(blob):
+    return int.from_bytes(blob, "big")
+
+
+class HashCache:
+    """
+    Persistent hash cache stored in a single SQLite file.
+
+    Entries are keyed by absolute path and hash key (see
+    `dedupe.indexer.cache_key`: the hasher and the scale the file was
+    decoded at, so hashes of different kinds, lengths and decodes coexist)
+    and validated against the file's size and mtime, so an unchanged file
+    costs one stat() instead of a decode.
+    Grayscale comparison thumbnails are kept next to the database in one
+    memory-mapped `ThumbnailStore` per size (`thumbnails(size)`); an entry
+    records its row there, so a rerun with other comparison settings
+    decodes nothing and copies no thumbnails. Rows left behind by changed
+    or deleted files are reclaimed by `vacuum`.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_cache_path()
+        parent = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(parent, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.path)
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != CACHE_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS hashes")
+            self.conn.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " path TEXT NOT NULL,"
+            " hasher TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " hash BLOB NOT NULL,"
+            " thumb_w INTEGER,"
+            " thumb_h INTEGER,"
+            " thumb_row INTEGER,"
+            " thumb_uid INTEGER,"
+            " PRIMARY KEY (path, hasher))"
+        )
+        self.conn.commit()
+
+        self.entries = {}
+        self.pending = []
+        self.stores = {}
+        self.hits = 0
+        self.misses = 0
+        self.removed = 0
+
+    def preload(self, folder_path, hasher=DEFAULT_HASHER):
+        """Load every entry with hash key `hasher` below `folder_path` in one query; `lookup` uses these."""
+        prefix = os.path.join(os.path.abspath(folder_path), "")
+        rows = self.conn.execute(
+            "SELECT path, size, mtime_ns, hash, thumb_w, thumb_h, thumb_row, thumb_uid FROM hashes"
+            " WHERE path >= ? AND path < ? AND hasher = ?",
+            (prefix, prefix[:-1] + chr(ord(os.sep) + 1), hasher),
+        )
+        for path, size, mtime_ns, blob, thumb_w, thumb_h, thumb_row, thumb_uid in rows:
+            thumb_size = (thumb_w, thumb_h) if thumb_w is not None else None
+            self.entries[path] = (size, mtime_ns, blob, thumb_size, thumb_row, thumb_uid)
+
+    def thumbnails(self, thumb_size):
+        """The ThumbnailStore holding this cache's thumbnails of `thumb_size`."""
+        thumb_size = tuple(thumb_size)
+        store = self.stores.get(thumb_size)
+        if store is None:
+            store = ThumbnailStore(f"{self.path}.thumbs-{thumb_size[0]}x{thumb_size[1]}", thumb_size)
+            self.stores[thumb_size] = store
+        return store
+
+    def lookup(self, path, stat, thumb_size=None):
+        """
+        Return `(hash, thumb_row)` for `path`, or None if missing or stale.
+
+        When `thumb_size` is given, only an entry whose thumbnail of that
+        size is in `thumbnails(thumb_size)` counts as a hit, and `thumb_row`
+        is its row there; otherwise `thumb_row` is None. Looked-up entries
+        are released from memory and exempt from `prune`.
+        """
+        key = os.path.abspath(path)
+        entry = self.entries.pop(key, None)
+        if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+            self.misses += 1
+            return None
+
+        thumb_row = None
+        if thumb_size is not None:
+            store = self.thumbnails(thumb_size)
+            size, thumb_row, uid = entry[3:]
+            if size != tuple(thumb_size) or uid != store.uid or thumb_row is None or thumb_row >= len(store):
+                self.misses += 1
+                return None
+
+        self.hits += 1
+        return _unpack_hash(entry[2]), thumb_row
+
+    def store(self, path, stat, hash_value, thumb=None, hasher=DEFAULT_HASHER):
+        """
+        Cache `hash_value` (under hash key `hasher`) for `path`; a (height, width)
+        `thumb` is appended to the matching ThumbnailStore. Returns the
+        thumbnail's row, or None.
+        """
+        key = os.path.abspath(path)
+        thumb_w = thumb_h = thumb_row = thumb_uid = None
+        if thumb is not None:
+            thumb_h, thumb_w = thumb.shape
+            store = self.thumbnails((thumb_w, thumb_h))
+            thumb_row, thumb_uid = store.append(thumb), store.uid
+        self.pending.append((
+            key, hasher, stat.st_size, stat.st_mtime_ns, _pack_hash(hash_value),
+            thumb_w, thumb_h, thumb_row, thumb_uid,
+        ))
+        if len(self.pending) >= 1000:
+            self.commit()
+        return thumb_row
+
+    def vacuum(self, min_garbage=0.5, block_rows=4096):
+        """
+        Rewrite each thumbnail store in which more than `min_garbage` of the
+        rows are no longer referenced (left behind by changed or deleted
+        files), keeping the referenced rows in order. Call it before
+        `preload`. Returns the number of rows dropped.
+
+        The compacted store gets a new uid and replaces the old file before
+        the database points at it, so an interrupted vacuum only costs
+        re-decoding. If the file can't be replaced (e.g. it is mapped by
+        another process on Windows) the store is left as it was.
+        """
+        self.commit()
+        dropped = 0
+        sizes = self.conn.execute(
+            "SELECT DISTINCT thumb_w, thumb_h FROM hashes WHERE thumb_w IS NOT NULL").fetchall()
+        for size in sizes:
+            store = self.thumbnails(size)
+            live = np.array([row for row, in self.conn.execute(
+                "SELECT DISTINCT thumb_row FROM hashes"
+                " WHERE thumb_w = ? AND thumb_h = ? AND thumb_uid = ? AND thumb_row < ?"
+                " ORDER BY thumb_row",
+                (*size, store.uid, len(store)),
+            )], dtype=np.int64)
+            if len(store) - len(live) <= min_garbage * len(store):
+                continue
+
+            compact = ThumbnailStore(f"{store.path}.tmp", store.size, reset=True)
+            old = store.array()
+            for start in range(0, len(live), block_rows):
+                compact.extend(old[live[start:start + block_rows]])
+            del old
+            compact.close()
+            self.conn.executemany(
+                "UPDATE hashes SET thumb_row = ?, thumb_uid = ?"
+                " WHERE thumb_w = ? AND thumb_h = ? AND thumb_uid = ? AND thumb_row = ?",
+                ((new_row, compact.uid, *size, store.uid, old_row)
+                 for new_row, old_row in enumerate(live.tolist())),
+            )
+            store.close()
+            try:
+                os.replace(compact.path, store.path)
+            except OSError:
+                self.conn.rollback()
+                os.remove(compact.path)
+            else:
+                self.conn.commit()
+                dropped += len(store) - len(live)
+            self.stores[tuple(size)] = ThumbnailStore(store.path, store.size)
+        return dropped
+
+    def prune(self):
+        """Drop preloaded entries that were never looked up and no longer exist on disk."""
+        stale = [p for p in self.entries if not os.path.exists(p)]
+        self.entries.clear()
+        self.conn.executemany("DELETE FROM hashes WHERE path = ?", ((p,) for p in stale))
+        self.removed += len(stale)
+
+    def commit(self):
+        # Rows must be on disk before the database points at them.
+        for store in self.stores.values():
+            store.flush()
+        if self.pending:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO hashes"
+                " (path, hasher, size, mtime_ns, hash, thumb_w, thumb_h, thumb_row, thumb_uid)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self.pending,
+            )
+            self.pending = []
+        self.conn.commit()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+        for store in self.stores.values():
+            store.close()
+
+    def summary(self):
+        return (f"Cache: {self.hits} hit(s), {self.misses} miss(es), "
+                f"{self.removed} stale entr{'y' if self.removed == 1 else 'ies'} removed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,156 @@
+"""
+Checkpoints that let an interrupted scan continue where it stopped.
+
+A checkpoint is an append-only JSON-lines file. The first line records the
+directory and every setting that affects the result, the second a
+fingerprint of the indexed records, and each later line the groups
+completed since the previous line together with the join's state at that
+point. Nothing is rewritten, so saving costs about the size of what is new;
+a line torn by a crash is ignored on loading.
+
+Hashes and thumbnails are not stored here: the scan keeps them in its
+`HashCache`, which is committed as it goes and revalidates every file by
+size and mtime, so resuming never decodes an unchanged file twice.
+"""
+import hashlib
+import json
+import os
+from .cache import default_cache_path
+
+CHECKPOINT_VERSION = 1
+
+
+def default_checkpoint_path(directory):
+    """A checkpoint file for scans of `directory`, next to the default hash cache."""
+    key = hashlib.blake2b(os.path.abspath(directory).encode("utf-8", "surrogateescape"),
+                          digest_size=8).hexdigest()
+    return os.path.join(os.path.dirname(default_cache_path()), "checkpoints", f"{key}.jsonl")
+
+
+def records_fingerprint(records):
+    """Digest of the paths, hashes and copies of a `RecordStore`, in record order."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(len(records).to_bytes(8, "little"))
+    digest.update("\0".join(records.dirs).encode("utf-8", "surrogateescape"))
+    digest.update(records.record_dirs.tobytes())
+    digest.update(records.name_ends.tobytes())
+    digest.update(bytes(records.names))
+    digest.update(records.packed_hashes().tobytes())
+    digest.update(json.dumps(sorted(records.copies.items())).encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
+
+
+class ScanCheckpoint:
+    """
+    Save and restore the progress of one scan in the file at `path`.
+
+    `settings` (JSON-serializable) identify the scan. With `resume`, an
+    existing checkpoint made with the same settings is loaded; `groups`
+    then holds the groups it had completed, as lists of
+    `[path, similarity, record_id]`. Its join state is only handed out by
+    `start_matching`, once the rebuilt records are known to be identical.
+    Otherwise (or if the file is missing, unreadable or from other
+    settings) the scan starts over and `note` says why.
+    """
+
+    def __init__(self, path, settings, resume=False):
+        self.path = path
+        self.settings = json.loads(json.dumps(settings))
+        self.groups = []
+        self.state = None
+        self.done = False
+        self.fingerprint = None
+        self.note = None
+
+        end = self._load() if resume else None
+        if end is None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.file = open(path, "wb")
+            self._write({"version": CHECKPOINT_VERSION, "settings": self.settings})
+        else:
+            # Reopen after the last complete line, dropping a torn tail.
+            self.file = open(path, "r+b")
+            self.file.seek(end)
+            self.file.truncate()
+
+    def _load(self):
+        """Read the checkpoint; return the offset after its last valid line, or None."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            self.note = f"Could not read checkpoint {self.path}: {e}"
+            return None
+
+        end = 0
+        entries = []
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+            end += len(line)
+
+        if not entries or entries[0].get("version") != CHECKPOINT_VERSION:
+            self.note = f"Checkpoint {self.path} is unreadable or from another version; starting over"
+            return None
+        if entries[0].get("settings") != self.settings:
+            self.note = f"Checkpoint {self.path} was made with other settings; starting over"
+            return None
+
+        for entry in entries[1:]:
+            if "fingerprint" in entry:
+                self.fingerprint = entry["fingerprint"]
+                continue
+            self.groups.extend(entry["groups"])
+            self.state = entry.get("state")
+            self.done = entry.get("done", False)
+        return end
+
+    def _write(self, entry):
+        self.file.write(json.dumps(entry, separators=(",", ":")).encode("ascii") + b"\n")
+        self.file.flush()
+
+    def start_matching(self, records):
+        """
+        Validate `records` against the checkpoint before the join starts.
+
+        Returns the join state to resume from (None to start at the
+        beginning). If the checkpoint's records differ, because files were
+        added, removed or changed since, its groups and state are dropped.
+        """
+        fingerprint = records_fingerprint(records)
+        if self.fingerprint is not None and self.fingerprint != fingerprint:
+            self.note = "The directory changed since the checkpoint; matching from the start"
+            self.groups, self.state, self.done = [], None, False
+            self.file.seek(0)
+            self.file.truncate()
+            self._write({"version": CHECKPOINT_VERSION, "settings": self.settings})
+            self.fingerprint = None
+        if self.fingerprint is None:
+            self.fingerprint = fingerprint
+            self._write({"fingerprint": fingerprint})
+        return self.state
+
+    def save(self, groups, state):
+        """Append groups completed since the last save and the join `state` they lead up to."""
+        self._write({"groups": groups, "state": state})
+
+    def finish(self, groups):
+        """Append the last groups and mark the scan complete."""
+        self._write({"groups": groups, "done": True})
+        self.done = True
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,5 +1,212 @@
+from collections import namedtuple
 from PIL import Image
 import numpy as np
+from . import profiling
+
+# Per-block statistics of a thumbnail stack at one coarse resolution.
+PyramidLevel = namedtuple("PyramidLevel", ["factor", "sums", "mins", "maxs"])
+
+def grayscale_thumbnail(img: Image.Image, size=(64, 64)) -> np.ndarray:
+    """
+    Resize to `size` and convert to GRAYSCALE.
+    Returns a uint8 array of shape (height, width).
+    """
+    # reducing_gap box-reduces a large image before the filter pass, with
+    # the exact geometry, so this is fast and format independent.
+    return np.asarray(img.resize(size, reducing_gap=3.0).convert("L"), dtype=np.uint8)
+
+
+def array_similarity(a1: np.ndarray, a2: np.ndarray, tolerance=10) -> float:
+    """
+    Same as `deep_similarity`, but on two precomputed grayscale thumbnails.
+    """
+    diff = np.abs(a1.astype(np.int16) - a2.astype(np.int16))
+    matches = np.count_nonzero(diff <= tolerance)
+    
+    return (matches / diff.size) * 100.0
+
+
+def batch_similarity(reference: np.ndarray, candidates: np.ndarray, tolerance=10,
+                     chunk_size=1024) -> np.ndarray:
+    """
+    Compare one grayscale thumbnail against an (N, H, W) stack of candidates.
+    Returns N % similarities, equal to calling `array_similarity` per candidate.
+    - `chunk_size` bounds the int16 temporaries to that many candidates
+      at a time (None compares all at once).
+
+    """
+    candidates = np.asarray(candidates)
+    count = len(candidates)
+    matches = np.empty(count, dtype=np.int64)
+    ref = reference.astype(np.int16)
+    step = chunk_size or count or 1
+    
+    for start in range(0, count, step):
+        block = candidates[start:start + step]
+        diff = np.abs(block.astype(np.int16) - ref)
+        matches[start:start + len(block)] = np.count_nonzero(
+            (diff <= tolerance).reshape(len(block), -1), axis=1
+        )
+    
+    return (matches / ref.size) * 100.0
+
+
+def pair_similarity(thumbs: np.ndarray, left, right, tolerance=10, chunk_size=1024) -> np.ndarray:
+    """
+    Elementwise % similarity of `thumbs[left[k]]` and `thumbs[right[k]]`.
+    Equal to calling `array_similarity` per pair, chunked like `batch_similarity`.
+    """
+    left = np.asarray(left, dtype=np.intp)
+    right = np.asarray(right, dtype=np.intp)
+    count = len(left)
+    matches = np.empty(count, dtype=np.int64)
+    step = chunk_size or count or 1
+    
+    for start in range(0, count, step):
+        a = thumbs[left[start:start + step]].astype(np.int16)
+        b = thumbs[right[start:start + step]].astype(np.int16)
+        matches[start:start + len(a)] = np.count_nonzero(
+            (np.abs(a - b) <= tolerance).reshape(len(a), -1), axis=1
+        )
+    
+    return (matches / thumbs[0].size) * 100.0
+
+
+def build_pyramid(thumbs: np.ndarray, factors=(8, 4), rows=None, block_rows=4096) -> list:
+    """
+    Precompute block sum/min/max of an (N, H, W) thumbnail stack for each
+    block `factor`, coarsest first. Used by `tiered_similarity`.
+
+    With `rows` (sorted), only those rows of `thumbs` are summarized, read
+    `block_rows` at a time, and the levels are indexed by position in
+    `rows`; pass the same `rows` to `tiered_similarity` as `pyramid_rows`.
+    """
+    count, height, width = thumbs.shape
+    if rows is not None:
+        rows = np.asarray(rows, dtype=np.intp)
+        count = len(rows)
+    levels = []
+    
+    for factor in factors:
+        bh, bw = height // factor, width // factor
+        if bh == 0 or bw == 0:
+            continue
+        level = PyramidLevel(
+            factor,
+            np.empty((count, bh, bw), dtype=np.int32),
+            np.empty((count, bh, bw), dtype=np.uint8),
+            np.empty((count, bh, bw), dtype=np.uint8),
+        )
+        for start in range(0, count, block_rows):
+            chunk = thumbs[start:start + block_rows] if rows is None else thumbs[rows[start:start + block_rows]]
+            blocks = chunk[:, :bh * factor, :bw * factor].reshape(len(chunk), bh, factor, bw, factor)
+            level.sums[start:start + len(chunk)] = blocks.sum(axis=(2, 4), dtype=np.int32)
+            level.mins[start:start + len(chunk)] = blocks.min(axis=(2, 4))
+            level.maxs[start:start + len(chunk)] = blocks.max(axis=(2, 4))
+        levels.append(level)
+    
+    return levels
+
+
+def _match_upper_bound(level: PyramidLevel, row, rows, tolerance, total) -> np.ndarray:
+    """
+    Upper bound on the number of matching pixels between thumbnail `row` and
+    each of `rows`, derived from block statistics only.
+
+    In a block of B pixels, no pair can differ by more than D (from the block
+    ranges), matching pairs differ by at most `tolerance`, and the sum of the
+    differences is at least |sum(a) - sum(b)|, so the number of mismatches
+    m satisfies m * (D - tolerance) >= |sum(a) - sum(b)| - B * tolerance.
+    If the ranges are further apart than `tolerance`, every pixel mismatches.
+    """
+    block = level.factor * level.factor
+    ref_min = level.mins[row].astype(np.int32)
+    ref_max = level.maxs[row].astype(np.int32)
+    mins = level.mins[rows].astype(np.int32)
+    maxs = level.maxs[rows].astype(np.int32)
+    
+    widest = np.maximum(maxs - ref_min, ref_max - mins)
+    closest = np.maximum(mins - ref_max, ref_min - maxs)
+    
+    excess = np.maximum(np.abs(level.sums[rows] - level.sums[row]) - block * tolerance, 0)
+    spread = np.maximum(widest - tolerance, 1)
+    mismatches = np.where(widest > tolerance, -(-excess // spread), 0)
+    mismatches = np.where(closest > tolerance, block, mismatches)
+    
+    return total - mismatches.reshape(len(rows), -1).sum(axis=1)
+
+
+class TierCounters:
+    """Counts how many candidates each comparison tier rejected."""
+    
+    def __init__(self):
+        self.candidates = 0
+        self.rejected = {}
+        self.full = 0
+    
+    def summary(self):
+        parts = [f"{self.candidates} candidate(s)"]
+        for factor, count in sorted(self.rejected.items(), reverse=True):
+            parts.append(f"{count} rejected at 1/{factor} scale")
+        parts.append(f"{self.full} compared at full size")
+        return "Comparisons: " + ", ".join(parts)
+
+
+def tiered_similarity(thumbs: np.ndarray, pyramid: list, row, rows, threshold, tolerance=10,
+                      counters=None, pyramid_rows=None) -> np.ndarray:
+    """
+    Coarse-to-fine version of `batch_similarity` for rows of a thumbnail stack.
+    Returns % similarity of `thumbs[row]` against each of `thumbs[rows]`, or
+    pairwise against `thumbs[row[k]]` when `row` is an array like `rows`.
+    - Each `pyramid` level (see `build_pyramid`) bounds the best achievable
+      match; candidates that can no longer reach `threshold` are rejected
+      and report that bound instead of their exact similarity.
+    - Candidates compared at full size get the exact `batch_similarity` value,
+      so the set reaching `threshold` is identical to a full comparison.
+    - `pyramid_rows` are the rows the pyramid was built over, if not all.
+
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    pairwise = np.ndim(row) > 0
+    if pairwise:
+        row = np.asarray(row, dtype=np.intp)
+    level_row, level_rows = row, rows
+    if pyramid_rows is not None:
+        level_row, level_rows = np.searchsorted(pyramid_rows, row), np.searchsorted(pyramid_rows, rows)
+    total = thumbs[0].size
+    result = np.empty(len(rows), dtype=np.float64)
+    alive = np.arange(len(rows))
+    
+    if counters is not None:
+        counters.candidates += len(rows)
+    profiling.count("comparisons", len(rows))
+    
+    for level in pyramid:
+        if len(alive) == 0 or tolerance >= 255:
+            break
+        with profiling.stage(f"compare_1/{level.factor}"):
+            refs = level_row[alive] if pairwise else level_row
+            bound = (_match_upper_bound(level, refs, level_rows[alive], tolerance, total) / total) * 100.0
+        reject = bound < threshold
+        result[alive[reject]] = bound[reject]
+        alive = alive[~reject]
+        rejected = int(reject.sum())
+        if counters is not None:
+            counters.rejected[level.factor] = counters.rejected.get(level.factor, 0) + rejected
+        profiling.count(f"rejected_at_1/{level.factor}", rejected)
+    
+    if len(alive):
+        with profiling.stage("compare_full"):
+            if pairwise:
+                result[alive] = pair_similarity(thumbs, row[alive], rows[alive], tolerance=tolerance)
+            else:
+                result[alive] = batch_similarity(thumbs[row], thumbs[rows[alive]], tolerance=tolerance)
+        if counters is not None:
+            counters.full += len(alive)
+        profiling.count("compared_full", len(alive))
+    
+    return result
+
 
 def deep_similarity(img1: Image.Image, img2: Image.Image, size=(64, 64), tolerance=10) -> float:
     """
@@ -8,13 +215,7 @@ def deep_similarity(img1: Image.Image, img2: Image.Image, size=(64, 64), toleran
     - `tolerance` allows small luminosity differences (0–255).
 
     """
-    i1 = img1.resize(size).convert("L")
-    i2 = img2.resize(size).convert("L")
-    
-    a1 = np.array(i1, dtype=np.int16)
-    a2 = np.array(i2, dtype=np.int16)
-    
-    matches = np.sum(np.abs(a1 - a2) <= tolerance)
-    total = a1.size
+    a1 = grayscale_thumbnail(img1, size)
+    a2 = grayscale_thumbnail(img2, size)
     
-    return (matches / total) * 100.0
+    return array_similarity(a1, a2, tolerance)
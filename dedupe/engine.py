@@ -0,0 +1,226 @@
+"""
+Indexing and matching as one cancellable job, shared by the CLI and the GUI.
+"""
+import os
+import threading
+import time
+from . import profiling
+from .cache import HashCache
+from .checkpoint import ScanCheckpoint
+from .comparer import TierCounters
+from .indexer import build_index, MAX_IMAGE_PIXELS
+from .matcher import iter_duplicate_groups
+from .snapshot import load_index, snapshot_settings
+
+
+class ScanEngine:
+    """
+    Run `build_index` and `iter_duplicate_groups` with throttled progress
+    and cooperative cancellation.
+
+    `progress(stage, done, total)` is called at most once per `interval`
+    seconds (and whenever a stage starts or ends), with `stage` 'index'
+    (total is None: the walk streams) or 'match'. `stop()` may be called from any
+    thread; every stage polls it between files or candidate chunks, so a
+    scan stops promptly. Groups yielded before the stop, plus the clusters
+    the match had found so far, remain valid partial results.
+
+    With a `checkpoint_path`, the scan's progress is saved there at least
+    every `checkpoint_interval` seconds (and when stopped), so that a later
+    scan with `resume` continues from it; see `iter_groups`.
+    """
+
+    def __init__(self, progress=None, interval=0.1, counters=None):
+        self.progress = progress
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.counters = counters if counters is not None else TierCounters()
+        self.records = None
+        self.groups = []
+        self._last = {}
+
+    def stop(self):
+        self.stop_event.set()
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def _report(self, stage, done, total, force=False):
+        if self.progress is None:
+            return
+        now = time.monotonic()
+        if force or now - self._last.get(stage, float('-inf')) >= self.interval:
+            self._last[stage] = now
+            self.progress(stage, done, total)
+
+    def iter_groups(self, directory, threshold=95, hash_distance=5, size=64, tolerance=10,
+                    cache_path=None, workers=1, max_pixels=MAX_IMAGE_PIXELS, tiered=True,
+                    index_kind='bktree', scan_options=None, exact_first=False, prefetch_bytes=0,
+                    verbose=False, details=False, checkpoint_path=None, resume=False,
+                    checkpoint_interval=30.0, max_candidates=None, index_path=None,
+                    rebuild_index=False, hasher='average', hash_bits=256):
+        """
+        Index `directory` and yield duplicate groups as `iter_duplicate_groups`
+        does (see `find_duplicates` for the options). Nothing is matched if
+        the scan was stopped while indexing. `self.records` holds the
+        indexed records afterwards.
+
+        With `checkpoint_path`, progress is checkpointed to that file (see
+        `ScanCheckpoint`); hashes and thumbnails go to the HashCache at
+        `cache_path`, or to one next to the checkpoint. With `resume`, a
+        checkpoint left by an interrupted scan of the same directory with
+        the same settings is continued: cached files are not decoded again,
+        the groups it had found are yielded first and the join picks up
+        where it was saved, provided the indexed files are exactly the same.
+
+        With `index_path`, an index snapshot there that was built with the
+        same settings is loaded instead of scanning `directory` (files
+        changed since are not noticed; pass `rebuild_index` to refresh it).
+        Otherwise the directory is indexed and the snapshot written.
+        """
+        checkpoint = None
+        if checkpoint_path is not None:
+            settings = dict(directory=os.path.abspath(directory), threshold=threshold,
+                            hash_distance=hash_distance, size=size, tolerance=tolerance,
+                            max_pixels=max_pixels, tiered=tiered, index_kind=index_kind,
+                            scan_options=scan_options or {}, exact_first=exact_first,
+                            max_candidates=max_candidates, hasher=f"{hasher}-{hash_bits}")
+            checkpoint = ScanCheckpoint(checkpoint_path, settings, resume=resume)
+            if cache_path is None:
+                cache_path = f"{checkpoint_path}.hashes"
+            if verbose and checkpoint.note:
+                print(checkpoint.note)
+        try:
+            yield from self._iter_groups(directory, checkpoint, threshold, hash_distance, size,
+                                         tolerance, cache_path, workers, max_pixels, tiered,
+                                         index_kind, scan_options, exact_first, prefetch_bytes,
+                                         verbose, details, checkpoint_interval, max_candidates,
+                                         index_path, rebuild_index, hasher, hash_bits)
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+
+    def _iter_groups(self, directory, checkpoint, threshold, hash_distance, size, tolerance,
+                     cache_path, workers, max_pixels, tiered, index_kind, scan_options,
+                     exact_first, prefetch_bytes, verbose, details, checkpoint_interval,
+                     max_candidates, index_path, rebuild_index, hasher, hash_bits):
+        stop = self.stop_event.is_set
+        done = [0]
+
+        def index_progress(count, total):
+            done[0] = count
+            self._report('index', count, total)
+
+        index_options = dict(
+            verbose=verbose,
+            workers=workers,
+            max_pixels=max_pixels,
+            thumb_size=(size, size),
+            index_kind=index_kind,
+            scan_options=scan_options,
+            exact_first=exact_first,
+            prefetch_bytes=prefetch_bytes,
+            hasher=hasher,
+            hash_bits=hash_bits,
+            should_stop=stop,
+            progress=index_progress,
+        )
+        loaded = None
+        if index_path is not None and not rebuild_index and os.path.exists(index_path):
+            loaded = self._load_index(index_path, snapshot_settings(
+                directory, max_pixels, (size, size), index_kind, scan_options, exact_first,
+                f"{hasher}-{hash_bits}"), verbose)
+        if loaded is not None:
+            records, tree, thumbs = loaded
+            done[0] = len(records)
+        elif cache_path is not None:
+            with HashCache(cache_path) as cache:
+                _, tree, records, thumbs = build_index(directory, cache=cache, snapshot=index_path,
+                                                       **index_options)
+        else:
+            _, tree, records, thumbs = build_index(directory, snapshot=index_path, **index_options)
+        self.records = records
+        self._report('index', done[0], None, force=True)
+
+        if self.stopped or len(records) == 0:
+            return
+
+        resume = None
+        if checkpoint is not None:
+            note = checkpoint.note
+            resume = checkpoint.start_matching(records)
+            if verbose and checkpoint.note is not note:
+                print(checkpoint.note)
+            if verbose and (checkpoint.groups or resume is not None):
+                print(f"Resuming from checkpoint: {len(checkpoint.groups)} group(s) found so far")
+            for group in checkpoint.groups:
+                yield [(path, similarity, records[record_id]) if details else (path, similarity)
+                       for path, similarity, record_id in group]
+            if checkpoint.done:
+                return
+
+        self._report('match', 0, len(records), force=True)
+        found = []
+        last_saved = [time.monotonic()]
+        cut_short = [False]
+
+        def save(state, stopping):
+            now = time.monotonic()
+            if stopping or now - last_saved[0] >= checkpoint_interval:
+                checkpoint.save(found[:], state())
+                del found[:]
+                last_saved[0] = now
+            cut_short[0] = stopping
+
+        groups = iter_duplicate_groups(
+            records,
+            tree,
+            thumbs,
+            threshold=threshold,
+            hash_distance=hash_distance,
+            tolerance=tolerance,
+            tiered=tiered,
+            counters=self.counters,
+            should_stop=stop,
+            progress=lambda count, total: self._report('match', count, total, force=count == total),
+            details=details or checkpoint is not None,
+            resume=resume,
+            checkpoint=save if checkpoint is not None else None,
+            max_candidates=max_candidates,
+        )
+        if checkpoint is None:
+            yield from groups
+            return
+
+        for group in groups:
+            # The matcher says when it stopped: groups after that are cut short
+            # and stay open in the saved state; every earlier one is complete.
+            if not cut_short[0]:
+                found.append([[path, similarity, record.id] for path, similarity, record in group])
+            yield group if details else [(path, similarity) for path, similarity, _ in group]
+        if not cut_short[0]:
+            checkpoint.finish(found)
+
+    def _load_index(self, index_path, settings, verbose):
+        try:
+            with profiling.stage("snapshot_load"):
+                records, tree, thumbs, saved = load_index(index_path)
+        except ValueError as e:
+            if verbose:
+                print(f"Ignoring index snapshot: {e}")
+            return None
+        if saved != settings or thumbs is None:
+            if verbose:
+                print(f"Index snapshot {index_path} was built with other settings; rebuilding it")
+            return None
+        if verbose:
+            print(f"Loaded {len(records)} images from index snapshot {index_path}")
+        return records, tree, thumbs
+
+    def run(self, directory, **options):
+        """Collect every group of `iter_groups` into `self.groups` and return it."""
+        self.groups = []
+        for group in self.iter_groups(directory, **options):
+            self.groups.append(group)
+        return self.groups
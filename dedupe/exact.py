@@ -0,0 +1,65 @@
+import hashlib
+import os
+from collections import defaultdict
+
+# Bytes read from each end of a file for the partial digest.
+PARTIAL_BLOCK = 64 * 1024
+
+
+def _digest(path, size, partial):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        if partial and size > 2 * PARTIAL_BLOCK:
+            digest.update(f.read(PARTIAL_BLOCK))
+            f.seek(-PARTIAL_BLOCK, os.SEEK_END)
+            digest.update(f.read(PARTIAL_BLOCK))
+        else:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.digest()
+
+
+def _split(entries, size, partial):
+    groups = defaultdict(list)
+    for entry in entries:
+        try:
+            key = _digest(entry[1], size, partial)
+        except OSError:
+            continue
+        groups[key].append(entry)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def find_exact_duplicates(entries, should_stop=None):
+    """
+    Group `(name, path, stat)` entries whose files are byte-identical.
+
+    Files are bucketed by size, then by a digest of their first and last
+    PARTIAL_BLOCK bytes, and only the survivors are digested in full.
+    Returns `(representatives, copies)`: the entries to keep, in input order
+    (every unique file plus the first file of each identical set), and a
+    dict mapping each representative's path to the paths of its copies.
+    If `should_stop` returns True between size buckets, the remaining
+    files are kept as unique.
+    """
+    by_size = defaultdict(list)
+    for entry in entries:
+        size = entry[2].st_size
+        if size > 0:
+            by_size[size].append(entry)
+
+    copies = {}
+    for size, same_size in by_size.items():
+        if len(same_size) < 2:
+            continue
+        if should_stop is not None and should_stop():
+            break
+        for group in _split(same_size, size, partial=True):
+            # Small files were digested in full by the first pass already.
+            identical = _split(group, size, partial=False) if size > 2 * PARTIAL_BLOCK else [group]
+            for same in identical:
+                copies[same[0][1]] = [entry[1] for entry in same[1:]]
+
+    skipped = {path for paths in copies.values() for path in paths}
+    representatives = [entry for entry in entries if entry[1] not in skipped]
+    return representatives, copies
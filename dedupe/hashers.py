@@ -1,10 +1,129 @@
+"""
+Perceptual hashes, computed in batches with NumPy.
+
+    hasher = get_hasher('dct', bits=64)
+    hasher.hash_image(img)                 # one PIL image -> int
+    hasher.hash_batch(pixels)              # (n, h, w) uint8 -> list of ints
+
+Every hasher reduces an image to `input_size` grayscale pixels
+(`pixels(image)`), derives `bits` booleans from them and packs them with
+`np.packbits`, first bit most significant. The hash is returned as a
+Python int, which is what the hash indexes and the cache store.
+"""
+import math
+import numpy as np
 from PIL import Image
 
+TINY_HASH_SIZE = (16, 16)
+
+# Bit lengths every hasher supports: squares of a side that keeps whole bytes.
+HASH_BITS = (64, 256, 1024)
+
+
+class Hasher:
+    """Base class; subclasses set `name`, compute `input_size` and implement `_bits`."""
+    name = None
+
+    def __init__(self, bits=256):
+        if bits not in HASH_BITS:
+            raise ValueError(f"Hash length must be one of {HASH_BITS}, not {bits}")
+        self.bits = bits
+        self.side = math.isqrt(bits)
+
+    @property
+    def key(self):
+        """Identifies the hash function, e.g. in caches and snapshots."""
+        return f"{self.name}-{self.bits}"
+
+    def __repr__(self):
+        return f"{type(self).__name__}(bits={self.bits})"
+
+    def pixels(self, image):
+        """The (height, width) uint8 grayscale array this hasher works on."""
+        return np.asarray(image.resize(self.input_size, reducing_gap=3.0).convert("L"), dtype=np.uint8)
+
+    def hash_batch(self, pixels):
+        """Hash a (n, height, width) stack of `pixels` arrays; returns n ints."""
+        pixels = np.asarray(pixels)
+        if len(pixels) == 0:
+            return []
+        packed = np.packbits(self._bits(pixels).reshape(len(pixels), -1), axis=1)
+        return [int.from_bytes(row.tobytes(), 'big') for row in packed]
+
+    def hash_array(self, pixels):
+        return self.hash_batch(pixels[None])[0]
+
+    def hash_image(self, image):
+        return self.hash_array(self.pixels(image))
+
+    def _bits(self, pixels):
+        raise NotImplementedError
+
+
+class AverageHash(Hasher):
+    """Each pixel brighter than the image's mean; with 256 bits, what `tiny_hash` computes."""
+    name = 'average'
+
+    @property
+    def input_size(self):
+        return (self.side, self.side)
+
+    def _bits(self, pixels):
+        pixels = pixels.astype(np.float64)
+        return pixels > pixels.mean(axis=(1, 2), keepdims=True)
+
+
+class DifferenceHash(Hasher):
+    """Each pixel brighter than its right neighbour; robust to brightness and contrast shifts."""
+    name = 'difference'
+
+    @property
+    def input_size(self):
+        return (self.side + 1, self.side)
+
+    def _bits(self, pixels):
+        return pixels[:, :, 1:] > pixels[:, :, :-1]
+
+
+class DCTHash(Hasher):
+    """
+    pHash: the lowest `side` x `side` frequencies of a 2-D DCT of a
+    4x larger image, each above their median (the DC term excluded).
+    """
+    name = 'dct'
+
+    def __init__(self, bits=256):
+        super().__init__(bits)
+        n = 4 * self.side
+        k = np.arange(self.side)[:, None]
+        # Rows of the DCT-II basis for the kept frequencies only.
+        self.basis = np.cos(np.pi * k * (2 * np.arange(n)[None, :] + 1) / (2 * n))
+
+    @property
+    def input_size(self):
+        return (4 * self.side, 4 * self.side)
+
+    def _bits(self, pixels):
+        low = self.basis @ pixels.astype(np.float64) @ self.basis.T
+        flat = low.reshape(len(low), -1)
+        median = np.median(flat[:, 1:], axis=1, keepdims=True)
+        return flat > median
+
+
+HASHERS = {
+    'average': AverageHash,
+    'difference': DifferenceHash,
+    'dct': DCTHash,
+}
+
+
+def get_hasher(name='average', bits=256):
+    """The `HASHERS` entry `name` producing `bits`-bit hashes."""
+    if name not in HASHERS:
+        raise ValueError(f"Unknown hasher {name!r}; expected one of {sorted(HASHERS)}")
+    return HASHERS[name](bits)
+
+
 def tiny_hash(image):
-    img = image.resize((16,16)).convert("L")
-    pixels = list(img.getdata())
-    avg = sum(pixels) / len(pixels)
-    hash_int = 0
-    for p in pixels:
-        hash_int = (hash_int << 1) | (1 if p > avg else 0)
-    return hash_int
+    """256-bit average hash of a 16x16 downscale of `image`."""
+    return get_hasher('average', 256).hash_image(image)
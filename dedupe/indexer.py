@@ -1,71 +1,485 @@
+import io
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
 from pathlib import Path
+import numpy as np
 from PIL import Image
-from .hashers import tiny_hash
-from .structures import HashTable, BKTree
+from . import profiling
+from .comparer import grayscale_thumbnail
+from .exact import find_exact_duplicates
+from .prefetch import prefetch
+from .hashers import get_hasher
+from .records import ImageRecord, RecordStore
+from .snapshot import save_index, snapshot_settings
+from .structures import HASH_INDEXES
+from .thumbstore import ThumbnailStore
 
 VALID_EXT = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
 
+# Images that would decode to more pixels than this are skipped. This bounds
+# memory per image and rejects decompression bombs.
+MAX_IMAGE_PIXELS = 64_000_000
 
-class ImageRecord:
-    def __init__(self, path, hash_value):
-        self.path = path
-        self.hash = hash_value
+# Read-ahead budget charged for a file whose size is unknown.
+_UNKNOWN_SIZE = 1 << 20
 
-    def __repr__(self):
-        return f"ImageRecord(path={self.path}, hash={self.hash})"
+# A reduced decode stays at least this many times larger than its target.
+# The final resize (with `reducing_gap`) then does all the filtering in one
+# pass, so the result barely depends on how the codec scaled the image.
+DECODE_HEADROOM = 4
 
 
-def load_image(path):
+def load_image(path, target_size=None, max_pixels=MAX_IMAGE_PIXELS, mode="L"):
+    """
+    Open an image, optionally decoding it at reduced resolution.
+
+    With `target_size` the codec is asked for the smallest scale that is
+    still DECODE_HEADROOM times larger (JPEG draft mode, decoding straight
+    to `mode`: "L" for hashing, "RGB" for display); other formats decode
+    at full size. Returns None if the file can't be opened or would
+    decode to more than `max_pixels` pixels.
+    """
     try:
-        return Image.open(path)
-    except (IOError, OSError) as e:
+        img = Image.open(path)
+    except (IOError, OSError, Image.DecompressionBombError):
+        return None
+
+    if target_size is not None:
+        img.draft(mode, (DECODE_HEADROOM * target_size[0], DECODE_HEADROOM * target_size[1]))
+
+    if max_pixels is not None and img.width * img.height > max_pixels:
+        img.close()
         return None
 
+    return img
 
-def scan_folder(folder_path):
+
+def _check_folder(folder_path):
     folder = Path(folder_path)
     if not folder.exists():
         raise FileNotFoundError(f"Folder not found: {folder_path}")
     if not folder.is_dir():
         raise NotADirectoryError(f"Not a directory: {folder_path}")
-    
-    entries = []
 
-    for name in os.listdir(folder_path):
-        if name.lower().endswith(VALID_EXT):
-            full = os.path.join(folder_path, name)
-            entries.append((name, full))
-    return entries
 
+def _matches(rel_path, patterns):
+    name = rel_path.rsplit("/", 1)[-1]
+    return any(fnmatch(rel_path, p) or fnmatch(name, p) for p in patterns)
 
-def build_index(folder_path, verbose = False):
-    index = HashTable(size=2048)
-    records = []
-    tree = BKTree()
-    files = scan_folder(folder_path)
 
-    if verbose:
-        print(f"Found {len(files)} image files")
+def _walk(folder_path, recursive, extensions, include, exclude, follow_symlinks):
+    stack = [(folder_path, "")]
+    visited = set()
+
+    while stack:
+        directory, rel_dir = stack.pop()
+        if follow_symlinks:
+            try:
+                st = os.stat(directory)
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev, st.st_ino))
+
+        try:
+            it = os.scandir(directory)
+        except OSError:
+            continue
+
+        subdirs = []
+        with it:
+            for entry in it:
+                rel_path = rel_dir + entry.name
+                try:
+                    if entry.is_symlink() and not follow_symlinks:
+                        continue
+                    if entry.is_dir():
+                        if recursive and not _matches(rel_path, exclude):
+                            subdirs.append((entry.path, rel_path + "/"))
+                        continue
+                    if not entry.name.lower().endswith(extensions):
+                        continue
+                    if include and not _matches(rel_path, include):
+                        continue
+                    if exclude and _matches(rel_path, exclude):
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.name, entry.path, stat
+
+        # Depth-first, visiting subdirectories in the order they were listed.
+        stack.extend(reversed(subdirs))
+
+
+def iter_images(folder_path, recursive=False, extensions=VALID_EXT, include=(), exclude=(),
+                follow_symlinks=False):
+    """
+    Lazily yield `(name, path, stat)` for each image file below `folder_path`.
+
+    Directories are read with `os.scandir` one at a time, so memory does not
+    grow with the size of the tree and the first entry is available at once.
+    `include`/`exclude` are glob patterns matched against the path relative
+    to `folder_path` (with `/` separators) or the file name; excluded
+    directories are not descended into. Symlinks are skipped unless
+    `follow_symlinks` is set, in which case directory cycles are detected.
+    """
+    _check_folder(folder_path)
+    extensions = tuple(ext.lower() for ext in extensions)
+    return _walk(folder_path, recursive, extensions, tuple(include), tuple(exclude),
+                 follow_symlinks)
+
+
+def scan_folder(folder_path, **scan_options):
+    return [(name, path) for name, path, _ in iter_images(folder_path, **scan_options)]
+
 
-    for i, (filename, path) in enumerate(files, 1):
-        img = load_image(path)
+def _decode_target(hasher, thumb_size):
+    target = hasher.input_size
+    if thumb_size is not None:
+        target = (max(target[0], thumb_size[0]), max(target[1], thumb_size[1]))
+    return target
+
+
+def cache_key(hasher, thumb_size=None):
+    """
+    The `HashCache` key for hashes made by `hasher` alongside `thumb_size`
+    thumbnails. The decode scale follows the larger of the two, so it is
+    part of the key: a hash is only reused for the same decode.
+    """
+    target = _decode_target(hasher, thumb_size)
+    return f"{hasher.key}@{target[0]}x{target[1]}"
+
+
+def _decode_file(path, max_pixels, thumb_size, hasher, data=None):
+    target = _decode_target(hasher, thumb_size)
+
+    source = io.BytesIO(data) if data is not None else path
+    with profiling.stage("decode"):
+        img = load_image(source, target_size=target, max_pixels=max_pixels)
         if img is None:
+            return None
+        try:
+            img.load()
+        except (IOError, OSError):
+            img.close()
+            return None
+    try:
+        with profiling.stage("hash_pixels"):
+            pixels = hasher.pixels(img)
+        thumb = None
+        if thumb_size is not None:
+            with profiling.stage("thumbnail"):
+                thumb = grayscale_thumbnail(img, thumb_size)
+        return pixels, thumb
+    except (IOError, OSError):
+        return None
+    finally:
+        img.close()
+
+
+def _hash_file(path, max_pixels=MAX_IMAGE_PIXELS, thumb_size=None, data=None, hasher=None):
+    hasher = hasher or get_hasher()
+    decoded = _decode_file(path, max_pixels, thumb_size, hasher, data)
+    if decoded is None:
+        return None
+    pixels, thumb = decoded
+    with profiling.stage("hash"):
+        return hasher.hash_array(pixels), thumb
+
+
+def _hash_chunk(files, max_pixels, thumb_size, hasher):
+    """`_hash_file` for each `(path, data)`, hashing the decoded chunk as one batch."""
+    decoded = [_decode_file(path, max_pixels, thumb_size, hasher, data) for path, data in files]
+    pixels = [d[0] for d in decoded if d is not None]
+    with profiling.stage("hash"):
+        hashes = iter(hasher.hash_batch(np.stack(pixels)) if pixels else [])
+    return [(next(hashes), d[1]) if d is not None else None for d in decoded]
+
+
+def hash_entries(entries, workers=1, max_pixels=MAX_IMAGE_PIXELS, thumb_size=None, cache=None,
+                 chunk_size=16, thumb_store=None, prefetch_bytes=0, hasher=None):
+    """
+    Stream `(name, path, stat, result)` for each `(name, path, stat)` entry,
+    in input order. `result` is `(hash, thumbnail)`, or None if the file
+    could not be loaded; the thumbnail is only computed when `thumb_size`
+    is given.
+
+    Entries found in `cache` are not decoded. With `workers > 1` the rest
+    are hashed in a process pool, `chunk_size` files per task, reading
+    `entries` lazily with a bounded number of tasks in flight.
+
+    With a `thumb_store` (a ThumbnailStore), or a `cache` and `thumb_size`
+    (which use `cache.thumbnails(thumb_size)`), thumbnails are written to
+    the store and `result` carries the row number instead of the array.
+
+    With `prefetch_bytes`, files that need decoding are read ahead on a
+    thread pool, up to that many bytes in flight (see `prefetch`), and
+    decoded from memory; this hides read latency on network filesystems.
+
+    `hasher` is a `dedupe.hashers.Hasher` (default: 256-bit average hash);
+    process-pool chunks are hashed as one batch. Cache entries are stored
+    under `cache_key(hasher, thumb_size)`; the caller preloads that key.
+    """
+    hasher = hasher or get_hasher()
+    key = cache_key(hasher, thumb_size)
+    if cache is not None and thumb_size is not None:
+        thumb_store = cache.thumbnails(thumb_size)
+
+    def lookup(path, stat):
+        if cache is None or stat is None:
+            return None
+        return cache.lookup(path, stat, thumb_size=thumb_size)
+
+    def keep(path, stat, result):
+        if result is None:
+            return None
+        h, thumb = result
+        if cache is not None:
+            row = cache.store(path, stat, h, thumb, hasher=key)
+        elif thumb_store is not None and thumb is not None:
+            row = thumb_store.append(thumb)
+        else:
+            return result
+        return h, row
+
+    looked_up = ((name, path, stat, lookup(path, stat)) for name, path, stat in entries)
+    if prefetch_bytes:
+        # Cache hits are passed through without being read.
+        stream = prefetch(
+            ((entry, entry[1] if entry[3] is None else None,
+              entry[2].st_size if entry[2] is not None else _UNKNOWN_SIZE) for entry in looked_up),
+            prefetch_bytes,
+        )
+    else:
+        stream = ((entry, None) for entry in looked_up)
+
+    if workers <= 1:
+        for (name, path, stat, result), data in stream:
+            if result is None:
+                result = keep(path, stat, _hash_file(path, max_pixels, thumb_size, data, hasher))
+            yield name, path, stat, result
+        return
+
+    def drain(batch, future):
+        results = None
+        if future is not None:
+            with profiling.stage("hash_pool_wait"):
+                results = iter(future.result())
+        for name, path, stat, result in batch:
+            if result is None:
+                result = keep(path, stat, next(results))
+            yield name, path, stat, result
+
+    # Cancel queued chunks if the consumer stops early, instead of finishing them.
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        in_flight = deque()
+        batch, misses = [], []
+        for (name, path, stat, result), data in stream:
+            batch.append((name, path, stat, result))
+            if result is None:
+                misses.append((path, data))
+            if len(misses) < chunk_size and len(batch) < chunk_size * 64:
+                continue
+
+            future = executor.submit(_hash_chunk, misses, max_pixels, thumb_size, hasher) if misses else None
+            in_flight.append((batch, future))
+            batch, misses = [], []
+            while in_flight and (len(in_flight) > workers * 4 or
+                                 in_flight[0][1] is None or in_flight[0][1].done()):
+                yield from drain(*in_flight.popleft())
+
+        if batch:
+            future = executor.submit(_hash_chunk, misses, max_pixels, thumb_size, hasher) if misses else None
+            in_flight.append((batch, future))
+        while in_flight:
+            yield from drain(*in_flight.popleft())
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def hash_files(paths, workers=1, max_pixels=MAX_IMAGE_PIXELS, thumb_size=None, prefetch_bytes=0,
+               hasher=None):
+    """
+    Yield `(hash, thumbnail)` (or None on load failure) for each path, in
+    input order. See `hash_entries`.
+    """
+    entries = ((None, path, None) for path in paths)
+    for _, _, _, result in hash_entries(entries, workers, max_pixels, thumb_size,
+                                        prefetch_bytes=prefetch_bytes, hasher=hasher):
+        yield result
+
+
+def _until(iterable, should_stop):
+    for item in iterable:
+        if should_stop():
+            return
+        yield item
+
+
+def build_index(folder_path, verbose = False, cache=None, workers=1, max_pixels=MAX_IMAGE_PIXELS,
+                thumb_size=None, index_kind='bktree', scan_options=None, exact_first=False,
+                thumb_store=None, prefetch_bytes=0, should_stop=None, progress=None, snapshot=None,
+                hasher='average', hash_bits=256):
+    """
+    Hash every image in `folder_path` and index it.
+
+    Files are streamed from `iter_images(folder_path, **scan_options)`
+    straight into hashing, so work starts before the directory walk ends.
+    If `cache` (a HashCache) is given, files whose size and mtime match a
+    cached entry are not decoded, and entries for deleted files are dropped.
+    `workers` > 1 hashes the remaining files in that many processes
+    (0 means one per CPU). Images larger than `max_pixels` are skipped.
+    `index_kind` picks the Hamming search structure returned as `tree`
+    (see `HASH_INDEXES`). `prefetch_bytes` enables read-ahead of files to
+    decode (see `hash_entries`).
+
+    `should_stop` is polled between files (and during the walk and the
+    exact-duplicate pass); once it returns True, queued work is cancelled
+    and the records indexed so far are returned. `progress(done, None)` is
+    called after every file.
+
+    With `exact_first`, byte-identical files are grouped before any decoding
+    (see `find_exact_duplicates`); only one file per identical set is hashed
+    and indexed, and the others are listed in its record's `copies`. This
+    needs the full listing up front, so hashing no longer streams; with
+    `verbose` the listing is also collected first, to print the file count
+    before hashing starts.
+
+    `records` is a `RecordStore`; `tree` holds record IDs (positions in
+    `records`) rather than record objects. The store also serves as `index`,
+    answering `HashTable`-style exact lookups with `get`/`exists`.
+
+    If `thumb_size` is given, the same decode also produces a grayscale
+    thumbnail per record, and a fourth value is returned: a contiguous uint8
+    array of shape (len(records), height, width) where row `record.row`
+    belongs to `record`. With a `cache`, the thumbnails live in the cache's
+    memory-mapped ThumbnailStore and the array is a read-only `np.memmap`
+    of it, which may hold rows of files outside this scan (the matcher only
+    reads this scan's rows); cached files are then neither decoded nor
+    copied. Rows no longer referenced are dropped by `HashCache.vacuum`,
+    run here once they make up half of a store. `thumb_store` is a file path for
+    the same out-of-core layout without a cache (started afresh each run).
+
+    `snapshot` is a file path to save the finished index to (see
+    `dedupe.snapshot.load_index`); a stopped scan is not saved.
+
+    `hasher` names the perceptual hash in `dedupe.hashers.HASHERS` and
+    `hash_bits` its length (one of `HASH_BITS`); records, index and cache
+    entries are sized and keyed accordingly.
+    """
+    hash_function = get_hasher(hasher, hash_bits)
+    records = RecordStore(bits=hash_bits, thumb_rows=thumb_size is not None)
+    index = records
+    tree = HASH_INDEXES[index_kind](bits=hash_bits)
+    entries = profiling.timed_iter("walk", iter_images(folder_path, **(scan_options or {})))
+    if should_stop is not None:
+        entries = _until(entries, should_stop)
+    if workers == 0:
+        workers = os.cpu_count() or 1
+
+    if cache is not None:
+        with profiling.stage("cache_vacuum"):
+            dropped = cache.vacuum()
+        if verbose and dropped:
+            print(f"Cache: compacted thumbnails, {dropped} unused row(s) dropped")
+
+    thumbs = None
+    if thumb_size is not None:
+        if cache is not None:
+            thumb_store = cache.thumbnails(thumb_size)
+        elif thumb_store is not None:
+            thumb_store = ThumbnailStore(thumb_store, thumb_size, reset=True)
+        else:
+            thumbs = np.empty((1024, thumb_size[1], thumb_size[0]), dtype=np.uint8)
+    else:
+        thumb_store = None
+
+    copies = {}
+    if exact_first:
+        with profiling.stage("exact_duplicates"):
+            entries, copies = find_exact_duplicates(list(entries), should_stop=should_stop)
+        if verbose:
+            skipped = sum(len(paths) for paths in copies.values())
+            print(f"Exact duplicates: {skipped} file(s) in {len(copies)} group(s), not decoded")
+    skipped_copies = sum(len(paths) for paths in copies.values())
+    if verbose:
+        entries = entries if isinstance(entries, list) else list(entries)
+        print(f"Found {len(entries) + skipped_copies} image files")
+
+    if cache is not None:
+        cache.preload(folder_path, hasher=cache_key(hash_function, thumb_size))
+
+    results = hash_entries(entries, workers=workers, max_pixels=max_pixels,
+                           thumb_size=thumb_size, cache=cache, thumb_store=thumb_store,
+                           prefetch_bytes=prefetch_bytes, hasher=hash_function)
+    scanned = 0
+
+    stopped = False
+    for scanned, (filename, path, stat, result) in enumerate(results, 1):
+        if progress is not None:
+            progress(scanned, None)
+        if should_stop is not None and should_stop():
+            results.close()
+            stopped = True
+            break
+        if result is None:
+            profiling.count("load_failures")
             if verbose:
                 print(f"  Skipped (load failed): {filename}")
             continue
+
+        h, thumb = result
+        with profiling.stage("index_insert"):
+            row = thumb if thumb_store is not None else None
+            record_id = records.append(path, h, copies=copies.get(path, ()), row=row)
+            tree.add(h, record_id)
+        if thumbs is not None:
+            if record_id == len(thumbs):
+                grown = np.empty((2 * len(thumbs),) + thumbs.shape[1:], dtype=np.uint8)
+                grown[:record_id] = thumbs
+                thumbs = grown
+            thumbs[record_id] = thumb
         
-        h = tiny_hash(img)
-        img.close()
-        record = ImageRecord(path, h)
-        index.insert(h, record)
-        tree.add(h, record)
-        records.append(record)
-        
-        if verbose and i % 100 == 0:
-            print(f"  Processed {i}/{len(files)} files...")
+        if verbose and scanned % 100 == 0:
+            print(f"  Processed {scanned} files...")
     
+    profiling.count("files_scanned", scanned + skipped_copies)
+    profiling.count("exact_copies", skipped_copies)
+    profiling.count("records_indexed", len(records))
+
+    if cache is not None:
+        # A stopped scan never looked up the rest, so it can't tell what is stale.
+        if not stopped:
+            cache.prune()
+        cache.commit()
+        profiling.count("cache_hits", cache.hits)
+        profiling.count("cache_misses", cache.misses)
+        if verbose:
+            print(cache.summary())
+
     if verbose:
         print(f"Successfully indexed {len(records)} images")
     
+    if thumb_store is not None:
+        thumbs = thumb_store.array()
+        if cache is None:
+            thumb_store.close()
+    elif thumbs is not None:
+        thumbs = thumbs[:len(records)]
+
+    if snapshot is not None and not stopped:
+        with profiling.stage("snapshot_save"):
+            save_index(snapshot, records, tree, thumbs, settings=snapshot_settings(
+                folder_path, max_pixels, thumb_size, index_kind, scan_options, exact_first,
+                hash_function.key))
+        if verbose:
+            print(f"Index snapshot written to {snapshot}")
+
+    if thumbs is not None:
+        return index, tree, records, thumbs
     return index, tree, records
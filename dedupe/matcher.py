@@ -0,0 +1,212 @@
+import heapq
+from itertools import islice
+import numpy as np
+from . import profiling
+from .comparer import build_pyramid, tiered_similarity
+from .structures import UnionFind
+
+
+def candidate_pairs(tree, records, hash_distance, max_candidates=None):
+    """
+    Yield `(i, j)` positions in `records`, i < j, for every pair of records
+    whose hashes are within `hash_distance`. `tree` must hold record
+    positions as values (as `build_index` fills it). Each pair is produced
+    once and i never decreases, provided `tree` was filled in `records`
+    order.
+
+    With `max_candidates`, a record is only paired with its
+    `max_candidates` nearest neighbours within `hash_distance` (found with
+    `tree.nearest`; a pair is kept if either side is among the other's
+    nearest), which bounds the work per record in dense clusters such as
+    burst shots. The neighbour lists are collected before the first pair
+    is yielded.
+    """
+    if max_candidates is not None:
+        yield from _nearest_pairs(tree, records, hash_distance, max_candidates)
+        return
+
+    if hasattr(tree, 'pairs_within'):
+        for a, b, _ in tree.pairs_within(hash_distance):
+            i, j = tree.values[a], tree.values[b]
+            yield (i, j) if i < j else (j, i)
+        return
+
+    for i, record in enumerate(records):
+        for j in sorted(tree.search(record.hash, threshold=hash_distance)):
+            if j > i:
+                yield i, j
+
+
+def _nearest_pairs(tree, records, hash_distance, max_candidates):
+    left, right = [], []
+    for i, record in enumerate(records):
+        # One extra neighbour, since the record finds itself.
+        for _, j in tree.nearest(record.hash, max_candidates + 1, max_distance=hash_distance):
+            if j != i:
+                left.append(min(i, j))
+                right.append(max(i, j))
+    if not left:
+        return
+    keys = np.unique(np.array(left, dtype=np.int64) * len(records) + np.array(right, dtype=np.int64))
+    for i, j in zip((keys // len(records)).tolist(), (keys % len(records)).tolist()):
+        yield i, j
+
+
+def iter_duplicate_groups(records, tree, thumbs, threshold=95, hash_distance=5, tolerance=10,
+                          tiered=True, counters=None, chunk_size=4096, should_stop=None,
+                          progress=None, details=False, resume=None, checkpoint=None,
+                          max_candidates=None):
+    """
+    Self-join `records` on hash distance, verify every candidate pair once
+    against the thumbnail matrix and yield connected duplicate clusters.
+
+    Each group is a list of `(path, similarity)`: the lowest-positioned record
+    first at 100.0, then the other members with the best similarity of any
+    verified match they took part in. Byte-identical `record.copies` follow
+    their record at 100.0, so a record with copies forms a group even without
+    perceptual matches. Groups are yielded as soon as no later pair can touch
+    them, so results stream while the join is running.
+
+    Args:
+        records: Records from `build_index`; `record.row` indexes `thumbs`
+        tree: Hash index the records were inserted into, in order
+        thumbs: Thumbnail matrix from `build_index(thumb_size=...)`
+        threshold: Similarity percentage threshold (0-100)
+        hash_distance: Maximum hamming distance for candidate pairs
+        tolerance: Grayscale pixel tolerance (0-255)
+        tiered: Reject clear non-matches on coarse levels first
+        counters: Optional TierCounters to accumulate comparison counts
+        chunk_size: Number of candidate pairs verified per vectorized call
+        should_stop: Optional callable; when it returns True the join stops
+            and the clusters found so far are yielded
+        progress: Optional callable `(done, total)` called after each chunk
+        details: Yield `(path, similarity, record)` instead, where `record`
+            is the matched record (the representative, for copies)
+        resume: A state from `checkpoint` to continue the join from; groups
+            yielded before that state was taken are not yielded again. The
+            records, tree and settings must be the same as for that run.
+        checkpoint: Optional callable `(state, stopping)` called after each
+            chunk, once that chunk's complete groups have been yielded;
+            `state()` returns the join's position and open clusters as a
+            JSON-serializable dict (for `resume`). `stopping` is True when
+            `should_stop` ended the join: the groups yielded after that call
+            are cut short and must not be recorded as found
+        max_candidates: Verify each record against at most this many of its
+            nearest hash neighbours (see `candidate_pairs`)
+    """
+    if getattr(records, 'thumb_rows', False):
+        rows = records.row_array()
+    else:
+        rows = np.array([record.row for record in records], dtype=np.intp)
+    # A cache's thumbnail store also holds rows of other scans; only these
+    # records' rows are summarized.
+    pyramid_rows = np.unique(rows) if len(rows) < len(thumbs) else None
+    with profiling.stage("build_pyramid"):
+        pyramid = build_pyramid(thumbs, rows=pyramid_rows) if tiered else []
+    clusters = UnionFind()
+    best = {}
+    highest = {}
+    heap = []
+    skip = limit = 0
+
+    if resume is not None:
+        skip, limit = resume['pairs'], resume['limit']
+        for members, similarities in zip(resume['open'], resume['best']):
+            for m, similarity in zip(members, similarities):
+                clusters.union(members[0], m)
+                best[m] = similarity
+            root = clusters.find(members[0])
+            highest[root] = max(members)
+            heap.append((highest[root], root))
+
+    for i, record in enumerate(records):
+        # Below `limit`, a lone record with copies has been yielded already.
+        if record.copies and i >= limit and i not in clusters.parent and i not in clusters.members:
+            highest[i] = i
+            heap.append((i, i))
+    heapq.heapify(heap)
+
+    def verify(left, right):
+        left = np.array(left, dtype=np.intp)
+        right = np.array(right, dtype=np.intp)
+        similarities = tiered_similarity(thumbs, pyramid, rows[left], rows[right], threshold,
+                                         tolerance=tolerance, counters=counters,
+                                         pyramid_rows=pyramid_rows)
+        for i, j, similarity in zip(left.tolist(), right.tolist(), similarities.tolist()):
+            if similarity < threshold:
+                continue
+            profiling.count("matches")
+            best[i] = max(best.get(i, 0.0), similarity)
+            best[j] = max(best.get(j, 0.0), similarity)
+            root_i, root_j = clusters.find(i), clusters.find(j)
+            high = max(highest.pop(root_i, i), highest.pop(root_j, j))
+            root = clusters.union(i, j)
+            highest[root] = high
+            heapq.heappush(heap, (high, root))
+
+    def finalize(limit):
+        """Yield clusters whose highest member is below `limit`."""
+        ready = []
+        while heap and heap[0][0] < limit:
+            high, root = heapq.heappop(heap)
+            if highest.get(root) != high or root in clusters.parent:
+                continue
+            del highest[root]
+            ready.append(sorted(clusters.discard(root)))
+        for members in sorted(ready):
+            group = []
+            for m in members:
+                record = records[m]
+                extra = (record,) if details else ()
+                group.append((record.path, best.pop(m, 100.0) if group else 100.0) + extra)
+                group.extend((path, 100.0) + extra for path in record.copies)
+            best.pop(members[0], None)
+            yield group
+
+    def state():
+        open_clusters = [clusters.members[root] for root in highest if root in clusters.members]
+        return {
+            'pairs': done,
+            'limit': limit,
+            'open': open_clusters,
+            'best': [[best[m] for m in members] for members in open_clusters],
+        }
+
+    pairs = candidate_pairs(tree, records, hash_distance, max_candidates=max_candidates)
+    if skip:
+        pairs = islice(pairs, skip, None)
+    done = skip
+    left, right = [], []
+    for i, j in profiling.timed_iter("candidate_pairs", pairs):
+        left.append(i)
+        right.append(j)
+        if len(left) < chunk_size:
+            continue
+
+        with profiling.stage("verify"):
+            verify(left, right)
+        done += len(left)
+        limit = i
+        yield from finalize(i)
+        if progress is not None:
+            progress(i, len(records))
+        # Decided once, so the checkpoint and the partial flush agree.
+        stopping = should_stop is not None and should_stop()
+        if checkpoint is not None:
+            checkpoint(state, stopping)
+        left, right = [], []
+        if stopping:
+            yield from finalize(float('inf'))
+            return
+
+    if left:
+        with profiling.stage("verify"):
+            verify(left, right)
+    yield from finalize(float('inf'))
+    if progress is not None:
+        progress(len(records), len(records))
+
+
+def find_duplicate_groups(records, tree, thumbs, **kwargs):
+    """List form of `iter_duplicate_groups`; takes the same arguments."""
+    return list(iter_duplicate_groups(records, tree, thumbs, **kwargs))
@@ -0,0 +1,63 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from . import profiling
+
+DEFAULT_PREFETCH_THREADS = 8
+
+
+def _read(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def prefetch(items, max_bytes, threads=DEFAULT_PREFETCH_THREADS, max_items=None):
+    """
+    Read files ahead of their consumer, in order.
+
+    `items` yields `(item, path, size)`; a `path` of None means nothing to
+    read. Yields `(item, data)` in input order, where `data` is the file's
+    bytes (None if unreadable or not requested). Reads are issued on
+    `threads` threads as far ahead as `max_bytes` of not-yet-consumed data
+    allows (always at least one file), so on high-latency storage many
+    requests are in flight while the caller works on earlier files.
+
+    At most `max_items` items (default: 4 per thread) are held, read or
+    not, so items with nothing to read (which cost no bytes) don't pull the
+    whole input in before the first one is yielded.
+    """
+    if max_items is None:
+        max_items = 4 * threads
+    items = iter(items)
+    in_flight = deque()
+    pending = 0
+    exhausted = False
+
+    executor = ThreadPoolExecutor(max_workers=threads)
+    try:
+        while True:
+            while not exhausted and (not in_flight or (pending < max_bytes and len(in_flight) < max_items)):
+                try:
+                    item, path, size = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future = executor.submit(_read, path) if path is not None else None
+                size = size if future is not None else 0
+                in_flight.append((item, future, size))
+                pending += size
+
+            if not in_flight:
+                return
+            item, future, size = in_flight.popleft()
+            pending -= size
+            data = None
+            if future is not None:
+                with profiling.stage("prefetch_wait"):
+                    data = future.result()
+                profiling.count("prefetched_bytes", len(data) if data is not None else 0)
+            yield item, data
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,163 @@
+"""
+Lightweight per-stage timing and counters.
+
+Instrumentation is global and off by default: `stage()` then returns a
+shared no-op context manager and `count()`/`observe()` return immediately,
+so instrumented code pays one global lookup per call. Call `enable()` (or
+use `profiling()`) to start collecting into a `Profile`.
+
+Only the current process is measured: with a process pool, decoding and
+hashing happen in the workers and show up as `hash_pool_wait` instead.
+Stages may nest, in which case their wall times overlap.
+"""
+import json
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+_active = None
+
+
+class Profile:
+    def __init__(self):
+        self.stages = defaultdict(lambda: [0, 0.0, 0.0])
+        self.counters = Counter()
+        self.histograms = defaultdict(Counter)
+
+    def report(self):
+        return {
+            "stages": {
+                name: {"calls": calls, "wall_s": wall, "cpu_s": cpu}
+                for name, (calls, wall, cpu) in self.stages.items()
+            },
+            "counters": dict(self.counters),
+            "histograms": {
+                name: {_bucket_label(b): n for b, n in sorted(buckets.items())}
+                for name, buckets in self.histograms.items()
+            },
+        }
+
+    def dump(self, path, **extra):
+        with open(path, "w") as f:
+            json.dump({**extra, **self.report()}, f, indent=2)
+            f.write("\n")
+
+
+def _bucket(value):
+    """Power-of-two bucket: 0, 1, 2-3, 4-7, ..."""
+    return int(value).bit_length()
+
+
+def _bucket_label(bucket):
+    if bucket <= 1:
+        return str(bucket)
+    return f"{1 << (bucket - 1)}-{(1 << bucket) - 1}"
+
+
+class _Stage:
+    __slots__ = ("profile", "name", "wall", "cpu")
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        entry = self.profile.stages[self.name]
+        entry[0] += 1
+        entry[1] += time.perf_counter() - self.wall
+        entry[2] += time.process_time() - self.cpu
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """Context manager timing one occurrence of stage `name`."""
+    if _active is None:
+        return _NULL_STAGE
+    return _Stage(_active, name)
+
+
+def count(name, n=1):
+    if _active is not None:
+        _active.counters[name] += n
+
+
+def observe(name, value):
+    """Add `value` to the power-of-two histogram `name`."""
+    if _active is not None:
+        _active.histograms[name][_bucket(value)] += 1
+
+
+def timed(name):
+    """Decorator timing every call of the wrapped function as stage `name`."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _Stage(_active, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def timed_iter(name, iterable):
+    """Time only the work done producing each item of `iterable`."""
+    if _active is None:
+        return iterable
+    return _timed_iter(_active, name, iter(iterable))
+
+
+def _timed_iter(profile, name, iterator):
+    while True:
+        with _Stage(profile, name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def enabled():
+    return _active is not None
+
+
+def enable():
+    """Start collecting into a fresh Profile and return it."""
+    global _active
+    _active = Profile()
+    return _active
+
+
+def disable():
+    """Stop collecting and return the Profile that was active, if any."""
+    global _active
+    profile, _active = _active, None
+    return profile
+
+
+@contextmanager
+def profiling():
+    profile = enable()
+    try:
+        yield profile
+    finally:
+        disable()
@@ -0,0 +1,193 @@
+import os
+from array import array
+import numpy as np
+from .structures import pack_hash, unpack_hash
+
+
+class ImageRecord:
+    """A standalone record; `RecordStore` hands out `RecordView`s with the same attributes."""
+    __slots__ = ("path", "hash", "row", "copies")
+
+    def __init__(self, path, hash_value, row=None, copies=()):
+        self.path = path
+        self.hash = hash_value
+        self.row = row
+        self.copies = list(copies)
+
+    def __repr__(self):
+        return f"ImageRecord(path={self.path}, hash={self.hash})"
+
+
+class RecordView:
+    """Read-only `ImageRecord` lookalike for one record of a `RecordStore`."""
+    __slots__ = ("store", "id")
+
+    def __init__(self, store, record_id):
+        self.store = store
+        self.id = record_id
+
+    @property
+    def path(self):
+        return self.store.path(self.id)
+
+    @property
+    def hash(self):
+        return self.store.hash(self.id)
+
+    @property
+    def row(self):
+        return self.store.rows[self.id] if self.store.thumb_rows else None
+
+    @property
+    def copies(self):
+        return self.store.copies.get(self.id, [])
+
+    def __eq__(self, other):
+        return isinstance(other, RecordView) and other.store is self.store and other.id == self.id
+
+    def __hash__(self):
+        return hash((id(self.store), self.id))
+
+    def __repr__(self):
+        return f"ImageRecord(path={self.path}, hash={self.hash})"
+
+
+class RecordStore:
+    """
+    Columnar storage for indexed images, addressed by integer record ID.
+
+    Hashes are packed into a uint64 array, directory prefixes are interned
+    and base names are kept UTF-8 encoded in one byte buffer, so a record
+    costs its packed hash, its encoded name and about 12 bytes of offsets
+    instead of a Python object per field. Byte-identical copies are stored
+    sparsely. Indexing or iterating yields `RecordView`s, which behave like
+    `ImageRecord`s; record IDs are positions. With `thumb_rows` each record
+    also has a thumbnail row, its ID unless given to `append`.
+
+    `get`/`exists` answer exact-hash lookups like `HashTable`, from a
+    dict of packed hash to record IDs built on the first lookup and kept
+    up to date by `append`; stores that are never queried don't pay for it.
+    """
+
+    def __init__(self, bits=256, thumb_rows=False):
+        self.bits = bits
+        self.words = (bits + 63) // 64
+        self.thumb_rows = thumb_rows
+        self.hashes = np.empty((1024, self.words), dtype=np.uint64)
+        self.dirs = []
+        self.dir_ids = {}
+        self.record_dirs = array('I')
+        self.name_ends = array('Q')
+        self.names = bytearray()
+        self.rows = array('q')
+        self.copies = {}
+        self._by_hash = None
+
+    def __len__(self):
+        return len(self.record_dirs)
+
+    def __getitem__(self, record_id):
+        if record_id < 0:
+            record_id += len(self)
+        if not 0 <= record_id < len(self):
+            raise IndexError("record id out of range")
+        return RecordView(self, record_id)
+
+    def __iter__(self):
+        return (RecordView(self, i) for i in range(len(self)))
+
+    def append(self, path, hash_value, copies=(), row=None):
+        """Add a record and return its ID."""
+        record_id = len(self)
+        if record_id == len(self.hashes):
+            grown = np.empty((max(1024, 2 * record_id), self.words), dtype=np.uint64)
+            grown[:record_id] = self.hashes
+            self.hashes = grown
+        self.hashes[record_id] = pack_hash(hash_value, self.words)
+        if self._by_hash is not None:
+            self._by_hash.setdefault(self.hashes[record_id].tobytes(), []).append(record_id)
+
+        name = os.path.basename(path)
+        directory = path[:len(path) - len(name)]
+        dir_id = self.dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self.dir_ids[directory] = len(self.dirs)
+            self.dirs.append(directory)
+        self.record_dirs.append(dir_id)
+        self.names += os.fsencode(name)
+        self.name_ends.append(len(self.names))
+
+        if self.thumb_rows:
+            self.rows.append(record_id if row is None else row)
+        if copies:
+            self.copies[record_id] = list(copies)
+        return record_id
+
+    def path(self, record_id):
+        start = self.name_ends[record_id - 1] if record_id else 0
+        name = os.fsdecode(bytes(self.names[start:self.name_ends[record_id]]))
+        return self.dirs[self.record_dirs[record_id]] + name
+
+    def hash(self, record_id):
+        return unpack_hash(self.hashes[record_id])
+
+    def row_array(self):
+        """Thumbnail row of every record, as an intp array."""
+        return np.frombuffer(self.rows, dtype=np.int64).astype(np.intp)
+
+    def packed_hashes(self):
+        """The (len(self), words) uint64 hash column, without copying."""
+        return self.hashes[:len(self)]
+
+    def to_arrays(self):
+        """The store's columns as numpy arrays (see `from_arrays`), copying as little as possible."""
+        arrays = {
+            'hashes': self.packed_hashes(),
+            'dirs': np.frombuffer(b"".join(os.fsencode(d) + b"\0" for d in self.dirs), dtype=np.uint8),
+            'record_dirs': np.frombuffer(self.record_dirs, dtype=np.uint32),
+            'name_ends': np.frombuffer(self.name_ends, dtype=np.uint64),
+            'names': np.frombuffer(self.names, dtype=np.uint8),
+        }
+        if self.thumb_rows:
+            arrays['rows'] = np.frombuffer(self.rows, dtype=np.int64)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, copies=None, bits=256):
+        """
+        A store over columns from `to_arrays`. `hashes` is used as is (so it
+        may be memory-mapped) until the first `append` grows it; the small
+        offset columns are copied into appendable arrays.
+        """
+        store = cls(bits=bits, thumb_rows='rows' in arrays)
+        store.hashes = arrays['hashes']
+        store.dirs = [os.fsdecode(d) for d in arrays['dirs'].tobytes().split(b"\0")[:-1]]
+        store.dir_ids = {d: i for i, d in enumerate(store.dirs)}
+        store.record_dirs.frombytes(arrays['record_dirs'].astype(np.uint32, copy=False).tobytes())
+        store.name_ends.frombytes(arrays['name_ends'].astype(np.uint64, copy=False).tobytes())
+        store.names = bytearray(arrays['names'].tobytes())
+        if 'rows' in arrays:
+            store.rows.frombytes(arrays['rows'].astype(np.int64, copy=False).tobytes())
+        store.copies = dict(copies or {})
+        return store
+
+    def get(self, hash_value):
+        """Views of every record with exactly `hash_value`, or None."""
+        if self._by_hash is None:
+            packed = np.ascontiguousarray(self.packed_hashes()).tobytes()
+            step = self.words * 8
+            self._by_hash = {}
+            for record_id, start in enumerate(range(0, len(packed), step)):
+                self._by_hash.setdefault(packed[start:start + step], []).append(record_id)
+        ids = self._by_hash.get(pack_hash(hash_value, self.words).tobytes())
+        return [RecordView(self, i) for i in ids] if ids else None
+
+    def exists(self, hash_value):
+        return self.get(hash_value) is not None
+
+    def nbytes(self):
+        """Approximate memory held by the store, excluding copies."""
+        return (self.hashes.nbytes + len(self.names) + self.record_dirs.itemsize * len(self.record_dirs)
+                + self.name_ends.itemsize * len(self.name_ends)
+                + self.rows.itemsize * len(self.rows)
+                + sum(len(d) + 100 for d in self.dirs))
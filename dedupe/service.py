@@ -0,0 +1,328 @@
+"""
+A resident near-duplicate index with a small local HTTP/JSON front end.
+
+    index = DuplicateIndex.build("library/", size=64)
+    server = make_server(index, port=8765)
+    server.serve_forever()
+
+    client = QueryClient("http://127.0.0.1:8765")
+    client.query("/uploads/new.jpg", threshold=95)
+
+Endpoints (JSON in, JSON out):
+    GET  /stats                     {"images": n, "thumb_size": [w, h]}
+    POST /query   {"path": p, ...}  {"path": p, "matches": [...]}
+    POST /query   {"paths": [...]}  {"results": [{"path": p, "matches": [...]}, ...]}
+    POST /insert  {"paths": [...]}  {"inserted": [...], "failed": [...]}
+    POST /remove  {"paths": [...]}  {"removed": [...], "missing": [...]}
+
+Queries take optional `threshold` (0-100), `hash_distance` (0 to the hash
+length) and `tolerance` (0-255), as numbers or numeric strings; the
+server's defaults apply otherwise. Malformed requests get a 400 with an
+`{"error"}` body. Paths are resolved with `os.path.abspath` (relative to
+the server's working directory). Each match is
+`{"path", "similarity", "distance"}`, best first.
+"""
+import json
+import os
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from .comparer import batch_similarity
+from .hashers import get_hasher
+from .indexer import build_index, MAX_IMAGE_PIXELS, _hash_file
+
+
+class DuplicateIndex:
+    """
+    Records, hash index and thumbnails from `build_index`, kept in memory to
+    answer near-duplicate queries and accept inserts and removals without a
+    rebuild.
+
+    Removed records are tombstoned rather than deleted from the hash index;
+    byte-identical copies count as images of their own (querying returns
+    them, removing the representative promotes a copy). `hasher` must be the
+    `Hasher` the index was built with. Paths are compared as absolute
+    paths. Thread-safe.
+    """
+
+    def __init__(self, records, tree, thumbs, threshold=95, hash_distance=5, tolerance=10,
+                 max_pixels=MAX_IMAGE_PIXELS, hasher=None):
+        self.records = records
+        self.tree = tree
+        self.base = thumbs
+        self.thumb_size = (thumbs.shape[2], thumbs.shape[1])
+        self.extra = np.empty((0,) + thumbs.shape[1:], dtype=np.uint8)
+        self.extra_count = 0
+        self.defaults = dict(threshold=threshold, hash_distance=hash_distance, tolerance=tolerance)
+        self.max_pixels = max_pixels
+        self.hasher = hasher if hasher is not None else get_hasher()
+        self.removed = set()
+        self.lock = threading.RLock()
+
+        self.ids = {}
+        for i in range(len(records)):
+            self.ids[os.path.abspath(records.path(i))] = i
+            for path in records.copies.get(i, ()):
+                self.ids[os.path.abspath(path)] = i
+
+    @classmethod
+    def build(cls, directory, size=64, threshold=95, hash_distance=5, tolerance=10, **index_options):
+        """Index `directory` (see `build_index` for `index_options`) and wrap the result."""
+        _, tree, records, thumbs = build_index(directory, thumb_size=(size, size), **index_options)
+        return cls(records, tree, thumbs, threshold=threshold, hash_distance=hash_distance,
+                   tolerance=tolerance, max_pixels=index_options.get('max_pixels', MAX_IMAGE_PIXELS),
+                   hasher=get_hasher(index_options.get('hasher', 'average'),
+                                     index_options.get('hash_bits', 256)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, path):
+        return os.path.abspath(path) in self.ids
+
+    def _thumb_rows(self, rows):
+        out = np.empty((len(rows),) + self.base.shape[1:], dtype=np.uint8)
+        for k, row in enumerate(rows):
+            out[k] = self.base[row] if row < len(self.base) else self.extra[row - len(self.base)]
+        return out
+
+    def _add_thumb(self, thumb):
+        if self.extra_count == len(self.extra):
+            grown = np.empty((max(64, 2 * len(self.extra)),) + self.extra.shape[1:], dtype=np.uint8)
+            grown[:self.extra_count] = self.extra[:self.extra_count]
+            self.extra = grown
+        self.extra[self.extra_count] = thumb
+        self.extra_count += 1
+        return len(self.base) + self.extra_count - 1
+
+    def _hash(self, path):
+        result = _hash_file(path, self.max_pixels, self.thumb_size, hasher=self.hasher)
+        if result is None:
+            raise ValueError(f"Could not load image: {path}")
+        return result
+
+    def query(self, path, threshold=None, hash_distance=None, tolerance=None):
+        """Return the indexed images similar to the image at `path`, best first."""
+        path = os.path.abspath(path)
+        h, thumb = self._hash(path)
+        return self.match(h, thumb, threshold, hash_distance, tolerance, exclude=path)
+
+    def match(self, hash_value, thumb, threshold=None, hash_distance=None, tolerance=None,
+              exclude=None):
+        """`query` for an already hashed image; `exclude` skips that (absolute) path in the results."""
+        threshold = self.defaults['threshold'] if threshold is None else threshold
+        hash_distance = self.defaults['hash_distance'] if hash_distance is None else hash_distance
+        tolerance = self.defaults['tolerance'] if tolerance is None else tolerance
+
+        with self.lock:
+            ids = [i for i in self.tree.search(hash_value, threshold=hash_distance)
+                   if i not in self.removed]
+            if not ids:
+                return []
+            candidates = self._thumb_rows([self.records.rows[i] for i in ids])
+            hashes = [self.records.hash(i) for i in ids]
+            paths = [[self.records.path(i)] + self.records.copies.get(i, []) for i in ids]
+
+        similarities = batch_similarity(thumb, candidates, tolerance=tolerance)
+        matches = []
+        for group, h, similarity in zip(paths, hashes, similarities.tolist()):
+            if similarity < threshold:
+                continue
+            distance = bin(hash_value ^ h).count('1')
+            matches.extend({"path": p, "similarity": similarity, "distance": distance}
+                           for p in group if os.path.abspath(p) != exclude)
+        matches.sort(key=lambda m: (-m["similarity"], m["distance"], m["path"]))
+        return matches
+
+    def query_batch(self, paths, **params):
+        """Query every path; unreadable images get an `error` instead of `matches`."""
+        results = []
+        for path in paths:
+            try:
+                results.append({"path": path, "matches": self.query(path, **params)})
+            except ValueError as e:
+                results.append({"path": path, "error": str(e)})
+        return results
+
+    def insert(self, path):
+        """Hash `path` and add it (replacing an earlier entry for it). Raises ValueError if unreadable."""
+        path = os.path.abspath(path)
+        h, thumb = self._hash(path)
+        return self._insert(path, h, thumb)
+
+    def query_insert(self, path, **params):
+        """`query` then `insert` `path`, decoding it once; returns the matches."""
+        path = os.path.abspath(path)
+        h, thumb = self._hash(path)
+        with self.lock:
+            matches = self.match(h, thumb, exclude=path, **params)
+            self._insert(path, h, thumb)
+        return matches
+
+    def _insert(self, path, h, thumb):
+        with self.lock:
+            self.remove(path)
+            row = self._add_thumb(thumb)
+            record_id = self.records.append(path, h, row=row)
+            self.tree.add(h, record_id)
+            self.ids[path] = record_id
+        return record_id
+
+    def remove(self, path):
+        """Forget `path`; returns False if it wasn't indexed."""
+        path = os.path.abspath(path)
+        with self.lock:
+            record_id = self.ids.pop(path, None)
+            if record_id is None:
+                return False
+            copies = self.records.copies.get(record_id, [])
+            copy = next((c for c in copies if os.path.abspath(c) == path), None)
+            if copy is not None:
+                copies.remove(copy)
+                return True
+
+            self.removed.add(record_id)
+            if copies:
+                # Promote the first copy; it has the same hash and thumbnail.
+                new_id = self.records.append(copies[0], self.records.hash(record_id), copies=copies[1:],
+                                             row=self.records.rows[record_id])
+                self.tree.add(self.records.hash(new_id), new_id)
+                for copy in copies:
+                    self.ids[os.path.abspath(copy)] = new_id
+            return True
+
+
+# Query parameter -> (type, minimum, maximum); None for hash_distance means the hash length.
+_QUERY_PARAMS = {
+    "threshold": (float, 0, 100),
+    "hash_distance": (int, 0, None),
+    "tolerance": (float, 0, 255),
+}
+
+
+def _query_params(request, bits):
+    """The query parameters of `request`, coerced and range-checked; raises ValueError."""
+    params = {}
+    for name, (kind, low, high) in _QUERY_PARAMS.items():
+        if name not in request:
+            continue
+        value = request[name]
+        high = bits if high is None else high
+        try:
+            if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+                raise ValueError
+            number = float(value)
+            if kind is int and not number.is_integer():
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"'{name}' must be {'an integer' if kind is int else 'a number'}") from None
+        if not low <= number <= high:
+            raise ValueError(f"'{name}' must be between {low} and {high}")
+        params[name] = kind(number)
+    return params
+
+
+def _paths(request, key):
+    value = request.get(key, [])
+    if not isinstance(value, list) or not all(isinstance(p, str) for p in value):
+        raise ValueError(f"'{key}' must be a list of paths")
+    return value
+
+
+def _handler(index):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != "/stats":
+                return self._reply(404, {"error": f"Unknown endpoint {self.path}"})
+            self._reply(200, {"images": len(index), "thumb_size": list(index.thumb_size)})
+
+        def do_POST(self):
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(request, dict):
+                    raise ValueError("Expected a JSON object")
+                params = _query_params(request, index.records.bits)
+                paths = _paths(request, "paths")
+                if "path" in request and not isinstance(request["path"], str):
+                    raise ValueError("'path' must be a string")
+            except ValueError as e:
+                return self._reply(400, {"error": str(e)})
+
+            if self.path == "/query":
+                if "paths" in request:
+                    return self._reply(200, {"results": index.query_batch(paths, **params)})
+                if "path" not in request:
+                    return self._reply(400, {"error": "Expected 'path' or 'paths'"})
+                try:
+                    matches = index.query(request["path"], **params)
+                except ValueError as e:
+                    return self._reply(422, {"path": request["path"], "error": str(e)})
+                return self._reply(200, {"path": request["path"], "matches": matches})
+
+            if self.path == "/insert":
+                inserted, failed = [], []
+                for path in paths:
+                    try:
+                        index.insert(path)
+                        inserted.append(path)
+                    except ValueError:
+                        failed.append(path)
+                return self._reply(200, {"inserted": inserted, "failed": failed})
+
+            if self.path == "/remove":
+                removed, missing = [], []
+                for path in paths:
+                    (removed if index.remove(path) else missing).append(path)
+                return self._reply(200, {"removed": removed, "missing": missing})
+
+            self._reply(404, {"error": f"Unknown endpoint {self.path}"})
+
+    return Handler
+
+
+def make_server(index, host="127.0.0.1", port=8765):
+    """An HTTP server answering for `index`; call `serve_forever()` on it. Port 0 picks a free one."""
+    return ThreadingHTTPServer((host, port), _handler(index))
+
+
+class QueryClient:
+    """Minimal client for `make_server`, using only the standard library."""
+
+    def __init__(self, url="http://127.0.0.1:8765", timeout=30):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _call(self, endpoint, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.url + endpoint, data=data,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def stats(self):
+        return self._call("/stats")
+
+    def query(self, path, **params):
+        return self._call("/query", dict(params, path=path))["matches"]
+
+    def query_batch(self, paths, **params):
+        return self._call("/query", dict(params, paths=list(paths)))["results"]
+
+    def insert(self, paths):
+        return self._call("/insert", {"paths": list(paths)})
+
+    def remove(self, paths):
+        return self._call("/remove", {"paths": list(paths)})
@@ -0,0 +1,172 @@
+"""
+Versioned binary snapshots of a built index, loaded by memory-mapping.
+
+    save_index("photos.idx", records, tree, thumbs, settings)
+    records, tree, thumbs, settings = load_index("photos.idx")
+
+The file is a HEADER_SIZE-byte header, then one section per array (the
+RecordStore columns, the hash index in flat arrays and the comparison
+thumbnails, each 64-byte aligned) and finally a JSON table giving every
+section's dtype, shape, offset and CRC32, plus the settings and copies.
+The header holds the table's position and CRC32. Loading maps the file
+once and views the sections in place, so a BK-tree or packed index is
+usable without re-inserting a single hash; only the small offset columns
+of the records are copied.
+"""
+import json
+import os
+import struct
+import zlib
+import numpy as np
+from .records import RecordStore
+from .structures import BKTree, FrozenBKTree, PackedHashIndex, MultiIndexHash
+
+SNAPSHOT_MAGIC = b"PDINDEX\0"
+SNAPSHOT_VERSION = 1
+
+# magic, version, table offset, table length, table CRC32; padded to HEADER_SIZE.
+_HEADER = struct.Struct("<8sIQQI")
+HEADER_SIZE = 64
+_ALIGN = 64
+
+# How each index kind is stored and what it loads as.
+SNAPSHOT_INDEXES = {
+    'bktree': FrozenBKTree,
+    'packed': PackedHashIndex,
+    'mih': MultiIndexHash,
+}
+
+
+def _index_kind(tree):
+    if isinstance(tree, (BKTree, FrozenBKTree)):
+        return 'bktree'
+    if isinstance(tree, PackedHashIndex):
+        return 'packed'
+    if isinstance(tree, MultiIndexHash):
+        return 'mih'
+    raise ValueError(f"Can't snapshot a {type(tree).__name__}")
+
+
+def snapshot_settings(folder_path, max_pixels, thumb_size, index_kind, scan_options=None,
+                      exact_first=False, hasher='average-256'):
+    """The settings a snapshot is stored with, normalized so they compare equal to a loaded one's."""
+    return json.loads(json.dumps(dict(
+        directory=os.path.abspath(folder_path),
+        max_pixels=max_pixels,
+        thumb_size=list(thumb_size) if thumb_size is not None else None,
+        index_kind=index_kind,
+        scan_options=scan_options or {},
+        exact_first=exact_first,
+        hasher=hasher,
+    )))
+
+
+def save_index(path, records, tree, thumbs=None, settings=None, block_rows=4096):
+    """
+    Write `records` (a RecordStore), `tree` and, if the records have
+    thumbnail rows, their rows of `thumbs` to a snapshot at `path`.
+
+    Thumbnails are written in record order, so the snapshot's thumbnail
+    matrix has one row per record even if `thumbs` is a larger cache
+    store; without `thumbs` the records are saved without thumbnail rows.
+    The file is written next to `path` and renamed over it.
+    """
+    sections = {f"records.{name}": array for name, array in records.to_arrays().items()}
+    sections.update((f"tree.{name}", array) for name, array in tree.to_arrays(records.bits).items())
+
+    rows = None
+    if records.thumb_rows and thumbs is not None:
+        rows = records.row_array()
+        sections["records.rows"] = np.arange(len(records), dtype=np.int64)
+    else:
+        # Without thumbnails the rows would point into a matrix that isn't there.
+        sections.pop("records.rows", None)
+
+    table = {
+        "settings": settings,
+        "bits": records.bits,
+        "index_kind": _index_kind(tree),
+        "copies": sorted(records.copies.items()),
+        "sections": {},
+    }
+
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER_SIZE)
+
+        def write_section(name, dtype, shape, blocks):
+            f.write(b"\0" * (-f.tell() % _ALIGN))
+            offset, crc = f.tell(), 0
+            for block in blocks:
+                data = np.ascontiguousarray(block, dtype=dtype).tobytes()
+                crc = zlib.crc32(data, crc)
+                f.write(data)
+            table["sections"][name] = {
+                "dtype": np.dtype(dtype).str, "shape": list(shape),
+                "offset": offset, "nbytes": f.tell() - offset, "crc32": crc,
+            }
+
+        for name, array in sections.items():
+            write_section(name, array.dtype, array.shape, [array])
+        if rows is not None:
+            shape = (len(rows),) + thumbs.shape[1:]
+            write_section("thumbs", np.uint8, shape,
+                          (thumbs[rows[start:start + block_rows]] for start in range(0, len(rows), block_rows)))
+
+        f.write(b"\0" * (-f.tell() % _ALIGN))
+        table_offset = f.tell()
+        table_data = json.dumps(table, separators=(",", ":")).encode("ascii")
+        f.write(table_data)
+        f.seek(0)
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, table_offset, len(table_data),
+                             zlib.crc32(table_data)).ljust(HEADER_SIZE, b"\0"))
+    os.replace(tmp_path, path)
+
+
+def load_index(path, verify=False):
+    """
+    Map the snapshot at `path` and return `(records, tree, thumbs, settings)`;
+    `thumbs` is None if it has none.
+
+    The header, the table and the CRC32 of every section except the
+    thumbnails are checked; with `verify`, the thumbnails too. Raises
+    ValueError if the file is truncated, corrupt or of another version.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError(f"{path} is not an index snapshot")
+    magic, version, table_offset, table_length, table_crc = _HEADER.unpack_from(header)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} is not an index snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"{path} is snapshot version {version}, expected {SNAPSHOT_VERSION}")
+    if table_offset + table_length != size:
+        raise ValueError(f"{path} is truncated")
+
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    table_data = data[table_offset:table_offset + table_length].tobytes()
+    if zlib.crc32(table_data) != table_crc:
+        raise ValueError(f"{path} is corrupt (table checksum mismatch)")
+    table = json.loads(table_data)
+
+    def section(name):
+        info = table["sections"][name]
+        offset, nbytes = info["offset"], info["nbytes"]
+        if offset < HEADER_SIZE or offset + nbytes > table_offset:
+            raise ValueError(f"{path} is corrupt (section {name} out of bounds)")
+        raw = data[offset:offset + nbytes]
+        if (verify or name != "thumbs") and zlib.crc32(raw) != info["crc32"]:
+            raise ValueError(f"{path} is corrupt (section {name} checksum mismatch)")
+        return raw.view(info["dtype"]).reshape(info["shape"])
+
+    def group(prefix):
+        return {name[len(prefix):]: section(name) for name in table["sections"] if name.startswith(prefix)}
+
+    copies = {int(record_id): paths for record_id, paths in table["copies"]}
+    records = RecordStore.from_arrays(group("records."), copies=copies, bits=table["bits"])
+    tree = SNAPSHOT_INDEXES[table["index_kind"]].from_arrays(group("tree."))
+    thumbs = section("thumbs") if "thumbs" in table["sections"] else None
+    return records, tree, thumbs, table["settings"]
@@ -1,3 +1,9 @@
+import heapq
+from bisect import bisect_left, bisect_right
+from itertools import combinations
+import numpy as np
+from . import profiling
+
 
 class HashTable:
     def __init__(self, size=1024):
@@ -31,7 +37,8 @@ class HashTable:
         return self.get(key) is not None
 
 class BKTree:
-    def __init__(self):
+    def __init__(self, bits=256):
+        self.bits = bits
         self.root = None
     
     def add(self, hash_val, value):
@@ -54,6 +61,7 @@ class BKTree:
             
             current = children[distance]
     
+    @profiling.timed("hash_search")
     def search(self, hash_val, threshold):
         if self.root is None:
             return []
@@ -73,4 +81,493 @@ class BKTree:
                 if d in children:
                     candidates.append(children[d])
         
+        profiling.observe("candidates_per_query", len(results))
+        return results
+
+    @profiling.timed("hash_nearest")
+    def nearest(self, hash_val, k, max_distance=None):
+        """
+        Return the `k` stored values closest to `hash_val` as `(distance, value)`,
+        nearest first, optionally only those within `max_distance`.
+
+        Nodes are visited best-first by the lower bound the triangle
+        inequality gives for their subtree, and the search radius shrinks to
+        the k-th best distance found so far, so far subtrees are never
+        entered once k close values are known.
+        """
+        if self.root is None or k <= 0:
+            return []
+        radius = float('inf') if max_distance is None else max_distance
+
+        best = []  # max-heap of (-distance, order, value)
+        order = 0
+        queue = [(0, 0, self.root)]
+        while queue:
+            bound, _, node = heapq.heappop(queue)
+            if bound > radius:
+                break
+            current_hash, children, values = node
+            distance = bin(hash_val ^ current_hash).count('1')
+
+            if distance <= radius:
+                for value in values:
+                    order += 1
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, -order, value))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, -order, value))
+                if len(best) == k:
+                    radius = min(radius, -best[0][0])
+
+            for d, child in children.items():
+                child_bound = abs(distance - d)
+                if child_bound <= radius:
+                    order += 1
+                    heapq.heappush(queue, (child_bound, order, child))
+
+        return [(-distance, value) for distance, _, value in sorted(best, reverse=True)]
+
+    def to_arrays(self, bits=256):
+        """
+        The tree's topology as flat arrays (see `FrozenBKTree`), nodes
+        numbered breadth-first. Values must be integers, e.g. record IDs.
+        """
+        return _flatten_bktree(self.root, (bits + 7) // 8)
+
+
+def _flatten_bktree(root, nbytes):
+    nodes = [root] if root is not None else []
+    node_hashes = bytearray()
+    value_offsets, values = [0], []
+    child_offsets, child_dists, child_nodes = [0], [], []
+    for node in nodes:  # grows while iterating: breadth-first
+        hash_val, children, node_values = node
+        node_hashes += hash_val.to_bytes(nbytes, 'big')
+        values.extend(node_values)
+        value_offsets.append(len(values))
+        for d in sorted(children):
+            child_dists.append(d)
+            child_nodes.append(len(nodes))
+            nodes.append(children[d])
+        child_offsets.append(len(child_dists))
+    return {
+        'node_hashes': np.frombuffer(bytes(node_hashes), dtype=np.uint8).reshape(len(nodes), nbytes),
+        'value_offsets': np.array(value_offsets, dtype=np.int64),
+        'values': np.array(values, dtype=np.int64),
+        'child_offsets': np.array(child_offsets, dtype=np.int64),
+        'child_dists': np.array(child_dists, dtype=np.int64),
+        'child_nodes': np.array(child_nodes, dtype=np.int64),
+    }
+
+
+class FrozenBKTree:
+    """
+    A BKTree laid out in flat arrays, as stored in an index snapshot.
+
+    Node `n` has the big-endian hash `node_hashes[n]`, the values
+    `values[value_offsets[n]:value_offsets[n + 1]]` and children
+    `child_nodes[...]` at edge distances `child_dists[...]` (sorted) between
+    `child_offsets[n]` and `child_offsets[n + 1]`. Searches read the arrays
+    in place, so a memory-mapped tree answers queries without creating an
+    object per node. Values added later go to a regular BKTree that is
+    searched alongside.
+    """
+
+    def __init__(self, node_hashes, value_offsets, values, child_offsets, child_dists, child_nodes):
+        self.count = len(node_hashes)
+        self.nbytes = node_hashes.shape[1] if node_hashes.ndim == 2 else 0
+        self.node_hashes = memoryview(np.ascontiguousarray(node_hashes, dtype=np.uint8).reshape(-1))
+        self.value_offsets = memoryview(np.ascontiguousarray(value_offsets, dtype=np.int64))
+        self.values = memoryview(np.ascontiguousarray(values, dtype=np.int64))
+        self.child_offsets = memoryview(np.ascontiguousarray(child_offsets, dtype=np.int64))
+        self.child_dists = memoryview(np.ascontiguousarray(child_dists, dtype=np.int64))
+        self.child_nodes = memoryview(np.ascontiguousarray(child_nodes, dtype=np.int64))
+        self.extra = BKTree()
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(**arrays)
+
+    def _hash(self, node):
+        start = node * self.nbytes
+        return int.from_bytes(self.node_hashes[start:start + self.nbytes], 'big')
+
+    def add(self, hash_val, value):
+        self.extra.add(hash_val, value)
+
+    @profiling.timed("hash_search")
+    def search(self, hash_val, threshold):
+        results = []
+        candidates = [0] if self.count else []
+        while candidates:
+            node = candidates.pop()
+            distance = bin(hash_val ^ self._hash(node)).count('1')
+
+            if distance <= threshold:
+                results.extend(self.values[self.value_offsets[node]:self.value_offsets[node + 1]].tolist())
+
+            start, end = self.child_offsets[node], self.child_offsets[node + 1]
+            lo = bisect_left(self.child_dists, distance - threshold, start, end)
+            hi = bisect_right(self.child_dists, distance + threshold, lo, end)
+            candidates.extend(self.child_nodes[lo:hi].tolist())
+
+        if self.extra.root is not None:
+            results.extend(self.extra.search(hash_val, threshold))
+        profiling.observe("candidates_per_query", len(results))
+        return results
+
+    @profiling.timed("hash_nearest")
+    def nearest(self, hash_val, k, max_distance=None):
+        """Like `BKTree.nearest`: the `k` closest `(distance, value)`, nearest first."""
+        if k <= 0:
+            return []
+        radius = float('inf') if max_distance is None else max_distance
+
+        best = []
+        order = 0
+        queue = [(0, 0)] if self.count else []
+        while queue:
+            bound, node = heapq.heappop(queue)
+            if bound > radius:
+                break
+            distance = bin(hash_val ^ self._hash(node)).count('1')
+
+            if distance <= radius:
+                for value in self.values[self.value_offsets[node]:self.value_offsets[node + 1]].tolist():
+                    order += 1
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, -order, value))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, -order, value))
+                if len(best) == k:
+                    radius = min(radius, -best[0][0])
+
+            start, end = self.child_offsets[node], self.child_offsets[node + 1]
+            for c in range(start, end):
+                child_bound = abs(distance - self.child_dists[c])
+                if child_bound <= radius:
+                    heapq.heappush(queue, (child_bound, self.child_nodes[c]))
+
+        found = [(-distance, value) for distance, _, value in sorted(best, reverse=True)]
+        if self.extra.root is not None:
+            found = sorted(found + self.extra.nearest(hash_val, k, max_distance),
+                           key=lambda item: item[0])[:k]
+        return found
+
+    def to_arrays(self, bits=256):
+        if self.extra.root is None:
+            return {
+                'node_hashes': np.frombuffer(self.node_hashes, dtype=np.uint8).reshape(self.count, self.nbytes),
+                'value_offsets': np.frombuffer(self.value_offsets, dtype=np.int64),
+                'values': np.frombuffer(self.values, dtype=np.int64),
+                'child_offsets': np.frombuffer(self.child_offsets, dtype=np.int64),
+                'child_dists': np.frombuffer(self.child_dists, dtype=np.int64),
+                'child_nodes': np.frombuffer(self.child_nodes, dtype=np.int64),
+            }
+        # Fold the added values in; any insertion order gives a valid tree.
+        tree = BKTree()
+        for node in range(self.count):
+            h = self._hash(node)
+            for value in self.values[self.value_offsets[node]:self.value_offsets[node + 1]].tolist():
+                tree.add(h, value)
+        for h, value in _bktree_items(self.extra.root):
+            tree.add(h, value)
+        return tree.to_arrays(bits)
+
+
+def _bktree_items(root):
+    nodes = [root] if root is not None else []
+    while nodes:
+        hash_val, children, values = nodes.pop()
+        for value in values:
+            yield hash_val, value
+        nodes.extend(children.values())
+
+
+def _popcount(words):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    bytes_ = words.view(np.uint8).reshape(words.shape + (8,))
+    return _POPCOUNT_TABLE[bytes_].sum(axis=-1, dtype=np.uint8)
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def pack_hash(hash_val, words):
+    """Split an integer hash into `words` big-endian uint64 words."""
+    return np.frombuffer(hash_val.to_bytes(words * 8, 'big'), dtype='>u8').astype(np.uint64)
+
+
+def unpack_hash(packed):
+    """Inverse of `pack_hash`."""
+    return int.from_bytes(np.asarray(packed, dtype='>u8').tobytes(), 'big')
+
+
+class PackedHashIndex:
+    """
+    Brute-force Hamming index over hashes packed into a dense uint64 array.
+
+    Queries XOR the query against blocks of stored hashes and popcount the
+    result, which for realistic collection sizes is faster than walking a
+    BK-tree node by node in Python. Drop-in for `BKTree.add`/`search`.
+    """
+
+    def __init__(self, bits=256, block_size=65536):
+        self.words = (bits + 63) // 64
+        self.block_size = block_size
+        self.hashes = np.empty((1024, self.words), dtype=np.uint64)
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, hash_val, value):
+        count = len(self.values)
+        if count == len(self.hashes):
+            grown = np.empty((max(1024, count * 2), self.words), dtype=np.uint64)
+            grown[:count] = self.hashes
+            self.hashes = grown
+        self.hashes[count] = pack_hash(hash_val, self.words)
+        self.values.append(value)
+
+    def to_arrays(self, bits=256):
+        return {
+            'hashes': self.hashes[:len(self.values)],
+            'values': np.array(self.values, dtype=np.int64),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Wrap `hashes` (e.g. memory-mapped) without copying; it is copied on the first `add`."""
+        index = cls(bits=arrays['hashes'].shape[1] * 64)
+        index.hashes = arrays['hashes']
+        index.values = arrays['values'].tolist()
+        return index
+
+    def distances(self, hash_val):
+        """Hamming distance from `hash_val` to every stored hash, in insertion order."""
+        query = pack_hash(hash_val, self.words)
+        count = len(self.values)
+        result = np.empty(count, dtype=np.int32)
+        for start in range(0, count, self.block_size):
+            block = self.hashes[start:min(start + self.block_size, count)]
+            result[start:start + len(block)] = _popcount(block ^ query).sum(axis=1)
+        return result
+
+    @profiling.timed("hash_search")
+    def search(self, hash_val, threshold):
+        matches = np.flatnonzero(self.distances(hash_val) <= threshold)
+        profiling.observe("candidates_per_query", len(matches))
+        return [self.values[i] for i in matches]
+
+    @profiling.timed("hash_nearest")
+    def nearest(self, hash_val, k, max_distance=None):
+        """Like `BKTree.nearest`: the `k` closest `(distance, value)`, nearest first."""
+        if k <= 0 or not self.values:
+            return []
+        distances = self.distances(hash_val)
+        if max_distance is not None:
+            ids = np.flatnonzero(distances <= max_distance)
+        else:
+            ids = np.arange(len(distances))
+        if len(ids) > k:
+            ids = ids[np.argpartition(distances[ids], k - 1)[:k]]
+        ids = ids[np.lexsort((ids, distances[ids]))]
+        return [(int(distances[i]), self.values[i]) for i in ids]
+
+    def pairs_within(self, threshold, block_size=1024):
+        """
+        Yield `(i, j, distance)` for every pair of stored hashes with i < j
+        and Hamming distance <= `threshold`, ordered by i then j. Indexes
+        follow insertion order.
+        """
+        count = len(self.values)
+        hashes = self.hashes[:count]
+        for start in range(0, count, block_size):
+            left = hashes[start:start + block_size]
+            found = []
+            for other in range(start, count, block_size):
+                right = hashes[other:other + block_size]
+                dist = _popcount(left[:, None, :] ^ right[None, :, :]).sum(axis=2, dtype=np.int32)
+                ii, jj = np.nonzero(dist <= threshold)
+                keep = ii + start < jj + other
+                ii, jj = ii[keep], jj[keep]
+                found.append((ii + start, jj + other, dist[ii, jj]))
+            if not found:
+                continue
+            ii, jj, dd = (np.concatenate(parts) for parts in zip(*found))
+            for k in np.lexsort((jj, ii)):
+                yield int(ii[k]), int(jj[k]), int(dd[k])
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing for Hamming range search.
+
+    Each hash is split into `substrings` chunks, with one exact-lookup table
+    per chunk. If two hashes are within distance r, at least one chunk pair
+    is within r // substrings (pigeonhole), so probing every table with the
+    query chunk's neighbours in that radius finds every true match; the
+    candidates are then verified against the full hash.
+    """
+
+    def __init__(self, bits=256, substrings=16):
+        if bits % substrings:
+            raise ValueError(f"{bits} bits can't be split into {substrings} equal substrings")
+        self.bits = bits
+        self.substrings = substrings
+        self.chunk_bits = bits // substrings
+        self.mask = (1 << self.chunk_bits) - 1
+        self.tables = [{} for _ in range(substrings)]
+        self.hashes = []
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def to_arrays(self, bits=256):
+        words = (self.bits + 63) // 64
+        hashes = np.empty((len(self.hashes), words), dtype=np.uint64)
+        for i, h in enumerate(self.hashes):
+            hashes[i] = pack_hash(h, words)
+        return {
+            'hashes': hashes,
+            'values': np.array(self.values, dtype=np.int64),
+            'substrings': np.array([self.substrings], dtype=np.int64),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild the lookup tables from the stored hashes (not a constant-time load)."""
+        index = cls(bits=arrays['hashes'].shape[1] * 64, substrings=int(arrays['substrings'][0]))
+        for packed, value in zip(arrays['hashes'], arrays['values'].tolist()):
+            index.add(unpack_hash(packed), value)
+        return index
+
+    def _chunks(self, hash_val):
+        for k in range(self.substrings):
+            yield k, (hash_val >> (k * self.chunk_bits)) & self.mask
+
+    def _neighbours(self, chunk, radius):
+        for r in range(min(radius, self.chunk_bits) + 1):
+            for bits in combinations(range(self.chunk_bits), r):
+                flipped = chunk
+                for b in bits:
+                    flipped ^= 1 << b
+                yield flipped
+
+    def add(self, hash_val, value):
+        item = len(self.values)
+        self.hashes.append(hash_val)
+        self.values.append(value)
+        for k, chunk in self._chunks(hash_val):
+            self.tables[k].setdefault(chunk, []).append(item)
+
+    def search_ids(self, hash_val, threshold):
+        """Return `(item, distance)` for every stored hash within `threshold`, by item."""
+        radius = threshold // self.substrings
+        candidates = set()
+        for k, chunk in self._chunks(hash_val):
+            table = self.tables[k]
+            for neighbour in self._neighbours(chunk, radius):
+                items = table.get(neighbour)
+                if items:
+                    candidates.update(items)
+
+        results = []
+        for item in sorted(candidates):
+            distance = bin(hash_val ^ self.hashes[item]).count('1')
+            if distance <= threshold:
+                results.append((item, distance))
         return results
+
+    @profiling.timed("hash_search")
+    def search(self, hash_val, threshold):
+        found = self.search_ids(hash_val, threshold)
+        profiling.observe("candidates_per_query", len(found))
+        return [self.values[item] for item, _ in found]
+
+    @profiling.timed("hash_nearest")
+    def nearest(self, hash_val, k, max_distance=None):
+        """
+        Like `BKTree.nearest`: the `k` closest `(distance, value)`, nearest first.
+
+        Range searches grow one chunk radius at a time until they hold k
+        values; a range search returns everything within its radius, so
+        those are the k nearest. Past a chunk radius of 2, where probing
+        costs more than it saves, every stored hash is compared instead.
+        """
+        if k <= 0 or not self.values:
+            return []
+        limit = self.bits if max_distance is None else min(max_distance, self.bits)
+        radius = min(self.substrings - 1, limit)
+        while True:
+            if radius // self.substrings > 2:
+                found = [(item, bin(hash_val ^ h).count('1')) for item, h in enumerate(self.hashes)]
+                found = [(item, distance) for item, distance in found if distance <= limit]
+                break
+            found = self.search_ids(hash_val, radius)
+            if len(found) >= k or radius >= limit:
+                break
+            radius = min(radius + self.substrings, limit)
+        found.sort(key=lambda item: (item[1], item[0]))
+        return [(distance, self.values[item]) for item, distance in found[:k]]
+
+    def pairs_within(self, threshold):
+        """Yield `(i, j, distance)` for every pair of stored hashes with i < j."""
+        for i, hash_val in enumerate(self.hashes):
+            for j, distance in self.search_ids(hash_val, threshold):
+                if j > i:
+                    yield i, j, distance
+
+
+class UnionFind:
+    """
+    Disjoint sets over hashable items, keeping the member list of every set
+    with more than one item. Items that were never merged are implicit.
+    """
+
+    def __init__(self):
+        self.parent = {}
+        self.members = {}
+
+    def find(self, item):
+        root = item
+        while root in self.parent:
+            root = self.parent[root]
+        while item != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        """Merge the sets of `a` and `b` and return the root of the result."""
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+
+        members_a = self.members.get(root_a, [root_a])
+        members_b = self.members.get(root_b, [root_b])
+        if len(members_a) < len(members_b):
+            root_a, root_b = root_b, root_a
+            members_a, members_b = members_b, members_a
+
+        self.parent[root_b] = root_a
+        members_a.extend(members_b)
+        self.members[root_a] = members_a
+        self.members.pop(root_b, None)
+        return root_a
+
+    def discard(self, root):
+        """Forget the set rooted at `root` and return its members."""
+        members = self.members.pop(root, [root])
+        for item in members:
+            self.parent.pop(item, None)
+        return members
+
+
+HASH_INDEXES = {
+    'bktree': BKTree,
+    'packed': PackedHashIndex,
+    'mih': MultiIndexHash,
+}
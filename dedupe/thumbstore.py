@@ -0,0 +1,108 @@
+import os
+import struct
+import numpy as np
+
+THUMBSTORE_MAGIC = b"PDTHUMBS"
+THUMBSTORE_VERSION = 1
+
+# magic, version, width, height, row count, store id; padded to HEADER_SIZE.
+_HEADER = struct.Struct("<8sIIIQQ")
+HEADER_SIZE = 64
+
+
+class ThumbnailStore:
+    """
+    Grayscale thumbnails of one size in a fixed-stride file, read through `np.memmap`.
+
+    The file is a HEADER_SIZE-byte header followed by `width * height`
+    bytes per row, so row `i` is at a fixed offset and `array()` exposes
+    every row without copying; the OS page cache decides what stays in
+    memory. Rows are only appended (`HashCache.vacuum` rewrites a store
+    without its unreferenced rows). An existing file is reused if its
+    header matches `size` and THUMBSTORE_VERSION, otherwise (or with
+    `reset`) it is started over under a new `uid`, which tells holders of
+    old row numbers that they are no longer valid.
+    """
+
+    def __init__(self, path, size, reset=False):
+        self.path = path
+        self.size = tuple(size)
+        self.stride = self.size[0] * self.size[1]
+
+        header = None
+        if not reset and os.path.exists(path):
+            with open(path, "rb") as f:
+                header = self._parse_header(f.read(HEADER_SIZE))
+
+        if header is None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.uid = int.from_bytes(os.urandom(8), "little") >> 1
+            self.count = 0
+            self.file = open(path, "w+b")
+            self._write_header()
+        else:
+            self.count, self.uid = header
+            self.file = open(path, "r+b")
+            # Drop a partially written row left by an interrupted run.
+            self.file.truncate(HEADER_SIZE + self.count * self.stride)
+
+    def _parse_header(self, data):
+        if len(data) < _HEADER.size:
+            return None
+        magic, version, width, height, count, uid = _HEADER.unpack_from(data)
+        if magic != THUMBSTORE_MAGIC or version != THUMBSTORE_VERSION or (width, height) != self.size:
+            return None
+        return count, uid
+
+    def _write_header(self):
+        header = _HEADER.pack(THUMBSTORE_MAGIC, THUMBSTORE_VERSION, self.size[0], self.size[1],
+                              self.count, self.uid)
+        self.file.seek(0)
+        self.file.write(header.ljust(HEADER_SIZE, b"\0"))
+
+    def __len__(self):
+        return self.count
+
+    def append(self, thumb):
+        """Write one (height, width) uint8 thumbnail and return its row."""
+        if thumb.shape != (self.size[1], self.size[0]):
+            raise ValueError(f"Expected a {self.size[0]}x{self.size[1]} thumbnail, got {thumb.shape}")
+        row = self.count
+        self.file.seek(HEADER_SIZE + row * self.stride)
+        self.file.write(np.ascontiguousarray(thumb, dtype=np.uint8).tobytes())
+        self.count += 1
+        return row
+
+    def extend(self, thumbs):
+        """Write a (n, height, width) block of thumbnails; returns the first row."""
+        thumbs = np.ascontiguousarray(thumbs, dtype=np.uint8)
+        if thumbs.shape[1:] != (self.size[1], self.size[0]):
+            raise ValueError(f"Expected {self.size[0]}x{self.size[1]} thumbnails, got {thumbs.shape[1:]}")
+        row = self.count
+        self.file.seek(HEADER_SIZE + row * self.stride)
+        self.file.write(thumbs.tobytes())
+        self.count += len(thumbs)
+        return row
+
+    def flush(self):
+        self._write_header()
+        self.file.flush()
+
+    def array(self):
+        """Read-only (len(self), height, width) view of every row."""
+        self.flush()
+        if self.count == 0:
+            return np.empty((0, self.size[1], self.size[0]), dtype=np.uint8)
+        return np.memmap(self.path, dtype=np.uint8, mode="r", offset=HEADER_SIZE,
+                         shape=(self.count, self.size[1], self.size[0]))
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
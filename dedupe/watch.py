@@ -0,0 +1,244 @@
+"""
+Watch a directory for new, changed and deleted images.
+
+On Linux, inotify is used through ctypes; elsewhere (or if inotify is
+unavailable) the tree is polled with the same scanner as `iter_images`.
+Either way a file is only reported once it has stopped changing for
+`settle` seconds, so partially written files are not hashed.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from .indexer import VALID_EXT, iter_images, _matches
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+               | IN_DELETE_SELF | IN_MOVE_SELF)
+_EVENT = struct.Struct("iIII")
+
+
+class _Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+
+    def add(self, directory):
+        wd = self._add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Can't watch {directory}")
+        self.dirs[wd] = directory
+
+    def read(self, timeout):
+        """Yield `(mask, path)` for the events available within `timeout` seconds."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            directory = self.dirs.get(wd)
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+            if mask & IN_Q_OVERFLOW:
+                yield mask, None
+            elif directory is not None:
+                yield mask, os.path.join(directory, name) if name else directory
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    """
+    Report settled changes below `folder_path` as `('changed' | 'removed', path)`.
+
+    `scan_options` are those of `iter_images`. Call `start()` before taking
+    the initial snapshot of the tree (e.g. `build_index`), so nothing that
+    changes in between is missed, then iterate `events()`.
+    """
+
+    def __init__(self, folder_path, recursive=False, extensions=VALID_EXT, include=(), exclude=(),
+                 follow_symlinks=False, settle=0.25, poll_interval=1.0, use_inotify=True):
+        self.folder_path = folder_path
+        self.scan_options = dict(recursive=recursive, extensions=extensions, include=include,
+                                 exclude=exclude, follow_symlinks=follow_symlinks)
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.inotify = None
+        self.known = {}
+        self.pending = {}
+
+    @property
+    def mode(self):
+        return "inotify" if self.inotify is not None else "polling"
+
+    def start(self):
+        if self.use_inotify:
+            try:
+                self.inotify = _Inotify()
+                self._watch_tree(self.folder_path, "")
+            except OSError:
+                if self.inotify is not None:
+                    self.inotify.close()
+                self.inotify = None
+        self.known = self._snapshot()
+        return self
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    def _rel(self, path):
+        return os.path.relpath(path, self.folder_path).replace(os.sep, "/")
+
+    def _wanted(self, path):
+        rel = self._rel(path)
+        include, exclude = self.scan_options["include"], self.scan_options["exclude"]
+        return (path.lower().endswith(self.extensions)
+                and (not include or _matches(rel, include))
+                and not (exclude and _matches(rel, exclude)))
+
+    def _watch_tree(self, directory, rel_dir):
+        self.inotify.add(directory)
+        if not self.scan_options["recursive"]:
+            return
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return
+        for entry in entries:
+            rel = rel_dir + entry.name
+            try:
+                if entry.is_symlink() and not self.scan_options["follow_symlinks"]:
+                    continue
+                if not entry.is_dir() or _matches(rel, self.scan_options["exclude"]):
+                    continue
+                self._watch_tree(entry.path, rel + "/")
+            except OSError:
+                continue
+
+    def _snapshot(self):
+        return {path: (stat.st_size, stat.st_mtime_ns)
+                for _, path, stat in iter_images(self.folder_path, **self.scan_options)}
+
+    def _touch(self, path):
+        self.pending[path] = time.monotonic() + self.settle
+
+    def _rescan(self):
+        current = self._snapshot()
+        for path, state in current.items():
+            if self.known.get(path) != state and path not in self.pending:
+                self._touch(path)
+        removed = [path for path in self.known if path not in current]
+        self.known.update((p, s) for p, s in current.items() if p not in self.pending)
+        for path in removed:
+            del self.known[path]
+            self.pending.pop(path, None)
+        return removed
+
+    def _on_event(self, mask, path):
+        """Handle one inotify event; return paths that were removed."""
+        if path is None:
+            # The kernel queue overflowed, so events were lost.
+            return self._rescan()
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and self.scan_options["recursive"]:
+                rel = self._rel(path)
+                if not _matches(rel, self.scan_options["exclude"]):
+                    try:
+                        self._watch_tree(path, rel + "/")
+                    except OSError:
+                        pass
+                    # Files may have landed before the watch was in place.
+                    for _, file_path, _ in iter_images(path, **self.scan_options):
+                        self._touch(file_path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                prefix = os.path.join(path, "")
+                return [p for p in list(self.known) if p.startswith(prefix) and self._forget(p)]
+            return []
+        if not self._wanted(path):
+            return []
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self.pending.pop(path, None)
+            return [path] if self._forget(path) else []
+        self._touch(path)
+        return []
+
+    def _forget(self, path):
+        return self.known.pop(path, None) is not None
+
+    def _settled(self):
+        """Pop pending paths whose deadline passed and whose size/mtime held still."""
+        now = time.monotonic()
+        changed = []
+        for path, deadline in list(self.pending.items()):
+            if deadline > now:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            state = (stat.st_size, stat.st_mtime_ns)
+            if time.time() - stat.st_mtime_ns / 1e9 < self.settle:
+                self.pending[path] = now + self.settle
+                continue
+            del self.pending[path]
+            if self.known.get(path) != state:
+                self.known[path] = state
+                changed.append(path)
+        return changed
+
+    def events(self, should_stop=None):
+        """Yield settled changes until `should_stop()` returns True."""
+        next_poll = time.monotonic() + self.poll_interval
+        while should_stop is None or not should_stop():
+            now = time.monotonic()
+            timeout = min([deadline for deadline in self.pending.values()] + [now + self.poll_interval]) - now
+            timeout = max(0.0, min(timeout, 0.5))
+
+            removed = []
+            if self.inotify is not None:
+                for mask, path in self.inotify.read(timeout):
+                    removed.extend(self._on_event(mask, path))
+            else:
+                time.sleep(timeout)
+                if time.monotonic() >= next_poll:
+                    removed.extend(self._rescan())
+                    next_poll = time.monotonic() + self.poll_interval
+
+            for path in removed:
+                yield 'removed', path
+            for path in self._settled():
+                yield 'changed', path
@@ -1,15 +1,17 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk
 import threading
+import os
+import shutil
+import tempfile
 from pathlib import Path
 import sys
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from cli.commands import find_duplicates
-from dedupe.indexer import build_index, load_image
-from dedupe.comparer import deep_similarity
+from dedupe.engine import ScanEngine
+from gui.results import ThumbnailCache, VirtualResultsList
 
 class DuplicateFinderGUI:
     def __init__(self, root):
@@ -19,6 +21,11 @@ class DuplicateFinderGUI:
         
         self.duplicate_groups = []
         self.scanning = False
+        self.engine = None
+        # Checkpoints and their hash cache live in a private directory for
+        # this session only; a scan is resumed only after the user stopped it.
+        self.session_dir = None
+        self.resumable = None
         
         self.setup_ui()
         
@@ -64,6 +71,9 @@ class DuplicateFinderGUI:
         size_spinner.grid(row=3, column=1, sticky=tk.W, padx=5)
         ttk.Label(params_frame, text="(NxN pixels)").grid(row=3, column=2, sticky=tk.W)
         
+        self.recursive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(params_frame, text="Include subfolders", variable=self.recursive_var).grid(row=4, column=0, sticky=tk.W, pady=2)
+        
         params_frame.columnconfigure(1, weight=1)
         
         action_frame = ttk.Frame(self.root, padding="10")
@@ -72,7 +82,7 @@ class DuplicateFinderGUI:
         self.scan_btn = ttk.Button(action_frame, text="Scan for Duplicates", command=self.start_scan)
         self.scan_btn.pack(side=tk.LEFT)
         
-        self.stop_btn = ttk.Button(action_frame, text="Stop", command=self.stop_scan, state=tk.DISABLED)
+        self.stop_btn = ttk.Button(action_frame, text="Stop", command=self.request_stop, state=tk.DISABLED)
         self.stop_btn.pack(side=tk.LEFT, padx=5)
         
         self.clear_btn = ttk.Button(action_frame, text="Clear Results", command=self.clear_results)
@@ -91,22 +101,9 @@ class DuplicateFinderGUI:
         results_frame = ttk.LabelFrame(self.root, text="Duplicate Groups", padding="5")
         results_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
         
-        canvas = tk.Canvas(results_frame)
-        scrollbar = ttk.Scrollbar(results_frame, orient="vertical", command=canvas.yview)
-        self.scrollable_frame = ttk.Frame(canvas)
-        
-        self.scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(scrollregion=canvas.bbox("all"))
-        )
-        
-        canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
-        
-        canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        self.results_container = self.scrollable_frame
+        # Only rows in view get widgets; previews are decoded off the Tk thread.
+        self.thumbnails = ThumbnailCache(self.root)
+        self.results_view = VirtualResultsList(results_frame, self.thumbnails, self.create_image_row)
         
     def browse_directory(self):
         directory = filedialog.askdirectory(title="Select Directory to Scan")
@@ -128,11 +125,31 @@ class DuplicateFinderGUI:
         self.progress_var.set("Scanning...")
         self.progress_bar.start()
         
+        self.engine = ScanEngine()
         thread = threading.Thread(target=self.run_scan, daemon=True)
         thread.start()
     
+    def request_stop(self):
+        """Stop button: the scan thread saves its progress and then ends the scan."""
+        if self.engine is not None:
+            self.engine.stop()
+        self.progress_var.set("Stopping...")
+        self.stop_btn.config(state=tk.DISABLED)
+    
+    def checkpoint_path(self):
+        if self.session_dir is None:
+            self.session_dir = tempfile.mkdtemp(prefix="photo_dedup_")
+        return os.path.join(self.session_dir, "scan.jsonl")
+    
+    def close(self):
+        self.thumbnails.close()
+        if self.session_dir is not None:
+            shutil.rmtree(self.session_dir, ignore_errors=True)
+    
     def stop_scan(self):
         self.scanning = False
+        if self.engine is not None:
+            self.engine.stop()
         self.progress_var.set("Scan stopped")
         self.progress_bar.stop()
         self.scan_btn.config(state=tk.NORMAL)
@@ -145,67 +162,48 @@ class DuplicateFinderGUI:
             threshold = self.threshold_var.get()
             hash_distance = self.hash_dist_var.get()
             size = self.size_var.get()
+            recursive = self.recursive_var.get()
             tolerance = self.tolerance_var.get()
             
             self.root.after(0, lambda: self.progress_var.set("Building index..."))
             
-            index, tree, records = build_index(directory, verbose=False)
+            # The engine throttles progress, so this posts a few events per second at most.
+            def report_progress(stage, done, total):
+                if stage == 'index':
+                    text = f"Indexed {done} images..."
+                elif done == 0:
+                    text = f"Comparing {total} images..."
+                else:
+                    text = f"Processing {done}/{total} images..."
+                self.root.after(0, lambda: self.progress_var.set(text))
             
-            if len(records) == 0:
+            engine = self.engine
+            engine.progress = report_progress
+            checkpoint_path = self.checkpoint_path()
+            resume = self.resumable == directory
+            self.resumable = None
+            duplicate_groups = engine.run(
+                directory,
+                threshold=threshold,
+                hash_distance=hash_distance,
+                size=size,
+                tolerance=tolerance,
+                scan_options=dict(recursive=recursive),
+                # Scan after Stop continues the stopped scan (if nothing changed)
+                # instead of redoing it.
+                checkpoint_path=checkpoint_path,
+                resume=resume
+            )
+            if engine.stopped:
+                self.resumable = directory
+            else:
+                os.remove(checkpoint_path)
+            
+            if engine.records is not None and len(engine.records) == 0 and not engine.stopped:
                 self.root.after(0, lambda: messagebox.showinfo("Info", "No images found in directory"))
-                self.root.after(0, self.stop_scan)
                 return
             
-            self.root.after(0, lambda: self.progress_var.set(f"Comparing {len(records)} images..."))
-            
-            duplicate_groups = []
-            processed = set()
-            comparison_size = (size, size)
-            
-            for i, record in enumerate(records):
-                if not self.scanning:
-                    break
-                    
-                if record.path in processed:
-                    continue
-                
-                progress_text = f"Processing {i + 1}/{len(records)} images..."
-                self.root.after(0, lambda t=progress_text: self.progress_var.set(t))
-                
-                candidates = tree.search(record.hash, threshold=hash_distance)
-                
-                img1 = load_image(record.path)
-                if img1 is None:
-                    continue
-                
-                group = []
-                
-                for candidate in candidates:
-                    if not self.scanning:
-                        break
-                        
-                    if candidate.path == record.path or candidate.path in processed:
-                        continue
-                    
-                    img2 = load_image(candidate.path)
-                    if img2 is None:
-                        continue
-                    
-                    similarity = deep_similarity(img1, img2, size=comparison_size, tolerance=tolerance)
-                    img2.close()
-                    
-                    if similarity >= threshold:
-                        if not group:
-                            group.append((record.path, 100.0))
-                        group.append((candidate.path, similarity))
-                        processed.add(candidate.path)
-                
-                img1.close()
-                
-                if group:
-                    processed.add(record.path)
-                    duplicate_groups.append(group)
-            
+            # A stopped scan still shows the groups it found.
             self.duplicate_groups = duplicate_groups
             
             self.root.after(0, self.display_results)
@@ -216,40 +214,22 @@ class DuplicateFinderGUI:
             self.root.after(0, self.stop_scan)
     
     def display_results(self):
-        for widget in self.results_container.winfo_children():
-            widget.destroy()
-        
+        self.results_view.set_groups(self.duplicate_groups, empty_text="No duplicates found!")
+        self.update_summary()
+    
+    def update_summary(self):
         if not self.duplicate_groups:
-            ttk.Label(self.results_container, text="No duplicates found!", 
-                     font=('Arial', 12)).pack(pady=20)
             self.progress_var.set("No duplicates found")
-            return
-        
-        self.progress_var.set(f"Found {len(self.duplicate_groups)} duplicate group(s)")
-        
-        for idx, group in enumerate(self.duplicate_groups, 1):
-            group_frame = ttk.LabelFrame(self.results_container, 
-                                         text=f"Group {idx} ({len(group)} images)",
-                                         padding="10")
-            group_frame.pack(fill=tk.X, pady=5, padx=5)
-            
-            for img_path, similarity in group:
-                self.create_image_row(group_frame, img_path, similarity, idx)
+        else:
+            self.progress_var.set(f"Found {len(self.duplicate_groups)} duplicate group(s)")
     
     def create_image_row(self, parent, img_path, similarity, group_id):
         row_frame = ttk.Frame(parent)
         row_frame.pack(fill=tk.X, pady=2)
         
-        try:
-            img = Image.open(img_path)
-            img.thumbnail((80, 80))
-            photo = ImageTk.PhotoImage(img)
-            
-            thumb_label = ttk.Label(row_frame, image=photo)
-            thumb_label.image = photo  # Keep reference
-            thumb_label.pack(side=tk.LEFT, padx=5)
-        except:
-            ttk.Label(row_frame, text="[No Preview]", width=10).pack(side=tk.LEFT, padx=5)
+        # Filled in by the thumbnail cache once the preview is decoded.
+        thumb_label = ttk.Label(row_frame, text="Loading...", width=10, anchor=tk.CENTER)
+        thumb_label.pack(side=tk.LEFT, padx=5)
         
         info_frame = ttk.Frame(row_frame)
         info_frame.pack(side=tk.LEFT, fill=tk.X, expand=True)
@@ -268,6 +248,8 @@ class DuplicateFinderGUI:
         
         ttk.Button(btn_frame, text="Open", command=lambda: self.open_image(img_path), width=8).pack(side=tk.LEFT, padx=2)
         ttk.Button(btn_frame, text="Delete", command=lambda: self.delete_image(img_path, group_id), width=8).pack(side=tk.LEFT, padx=2)
+        
+        return thumb_label
     
     def open_image(self, path):
         import subprocess
@@ -305,21 +287,25 @@ class DuplicateFinderGUI:
             try:
                 Path(path).unlink()
                 messagebox.showinfo("Success", "File deleted successfully")
-                # Refresh results
-                self.display_results()
+                # Drop just this row; only the visible rows are rebuilt
+                self.results_view.remove(path)
+                self.duplicate_groups = self.results_view.groups
+                self.update_summary()
             except Exception as e:
                 messagebox.showerror("Error", f"Could not delete file: {str(e)}")
     
     def clear_results(self):
-        for widget in self.results_container.winfo_children():
-            widget.destroy()
+        self.results_view.clear()
         self.duplicate_groups = []
         self.progress_var.set("Ready")
 
 def main():
     root = tk.Tk()
     app = DuplicateFinderGUI(root)
-    root.mainloop()
+    try:
+        root.mainloop()
+    finally:
+        app.close()
 
 if __name__ == "__main__":
     main()
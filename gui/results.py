@@ -0,0 +1,266 @@
+import threading
+import tkinter as tk
+from bisect import bisect_right
+from collections import OrderedDict
+from tkinter import ttk
+from PIL import ImageTk
+from dedupe.indexer import load_image
+
+HEADER_HEIGHT = 32
+ROW_HEIGHT = 92
+PREVIEW_SIZE = (80, 80)
+
+
+class ThumbnailCache:
+    """
+    Decode previews on a background thread and keep the most recently used
+    ones, bounded by `max_items` and `max_bytes`.
+
+    Requests are served newest first, so the rows currently on screen are
+    decoded before ones the user has already scrolled past. `callback` runs
+    on the Tk thread (via `root.after`) with the PIL image, or None if the
+    file can't be read.
+    """
+
+    def __init__(self, root, max_items=2000, max_bytes=64 * 1024 * 1024):
+        self.root = root
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()
+        self.nbytes = 0
+        self.requests = []
+        self.waiting = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.closed = False
+        threading.Thread(target=self._work, daemon=True).start()
+
+    def get(self, path):
+        with self.lock:
+            img = self.images.get(path)
+            if img is not None:
+                self.images.move_to_end(path)
+            return img
+
+    def request(self, path, callback):
+        """Return the cached preview for `path`, or decode it and call `callback` later."""
+        with self.lock:
+            img = self.images.get(path)
+            if img is not None:
+                self.images.move_to_end(path)
+                return img
+            self.waiting.setdefault(path, []).append(callback)
+            self.requests.append(path)
+            self.wakeup.notify()
+        return None
+
+    def cancel(self, paths):
+        """Forget pending requests for `paths`, e.g. rows scrolled out of view."""
+        with self.lock:
+            for path in paths:
+                self.waiting.pop(path, None)
+            if not self.waiting:
+                self.requests.clear()
+
+    def discard(self, path):
+        with self.lock:
+            img = self.images.pop(path, None)
+            if img is not None:
+                self.nbytes -= _image_bytes(img)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+
+    def _work(self):
+        while True:
+            with self.lock:
+                while not self.requests and not self.closed:
+                    self.wakeup.wait()
+                if self.closed:
+                    return
+                path = self.requests.pop()
+                if path not in self.waiting:
+                    continue
+                img = self.images.get(path)
+
+            if img is None:
+                img = self._decode(path)
+
+            with self.lock:
+                if img is not None and path not in self.images:
+                    self.images[path] = img
+                    self.nbytes += _image_bytes(img)
+                    while self.images and (len(self.images) > self.max_items or self.nbytes > self.max_bytes):
+                        _, old = self.images.popitem(last=False)
+                        self.nbytes -= _image_bytes(old)
+                callbacks = self.waiting.pop(path, [])
+            for callback in callbacks:
+                self.root.after(0, callback, img)
+
+    def _decode(self, path):
+        img = load_image(path, target_size=PREVIEW_SIZE, mode="RGB")
+        if img is None:
+            return None
+        try:
+            img.thumbnail(PREVIEW_SIZE)
+            return img.convert("RGB")
+        except (IOError, OSError):
+            return None
+        finally:
+            img.close()
+
+
+def _image_bytes(img):
+    return img.width * img.height * len(img.getbands())
+
+
+class VirtualResultsList:
+    """
+    Scrollable list of duplicate groups that only creates widgets for the
+    rows in (or near) the viewport.
+
+    Groups are flattened into fixed-height header and image rows whose y
+    offsets are precomputed, so showing any number of groups costs the same
+    as showing one screenful. `make_row(parent, path, similarity, group_id)`
+    builds an image row's widgets and returns the label to put the preview
+    in; previews come from a ThumbnailCache.
+    """
+
+    def __init__(self, parent, thumbnails, make_row, overscan=4):
+        self.thumbnails = thumbnails
+        self.make_row = make_row
+        self.overscan = overscan
+        self.groups = []
+        self.rows = []
+        self.offsets = [0]
+        self.visible = {}
+        self.pending = False
+        self.empty_text = None
+
+        self.canvas = tk.Canvas(parent, highlightthickness=0, yscrollincrement=HEADER_HEIGHT)
+        self.scrollbar = ttk.Scrollbar(parent, orient="vertical", command=self._yview)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.canvas.bind("<Configure>", lambda e: self._schedule())
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.canvas.bind_all(sequence, self._on_wheel, add="+")
+
+    def set_groups(self, groups, empty_text=None):
+        self.groups = [list(group) for group in groups]
+        self.empty_text = empty_text
+        self._layout()
+        self.canvas.yview_moveto(0)
+
+    def remove(self, path):
+        """Drop `path` from every group; groups left with one image disappear."""
+        changed = False
+        for group in self.groups:
+            for k, (p, _) in enumerate(group):
+                if p == path:
+                    del group[k]
+                    changed = True
+                    break
+        if changed:
+            self.groups = [group for group in self.groups if len(group) > 1]
+            self.thumbnails.discard(path)
+            self._layout()
+        return changed
+
+    def clear(self):
+        self.set_groups([])
+
+    def _layout(self):
+        self.rows = []
+        self.offsets = [0]
+        for group_id, group in enumerate(self.groups, 1):
+            self.rows.append((group_id, None, len(group)))
+            self.offsets.append(self.offsets[-1] + HEADER_HEIGHT)
+            for path, similarity in group:
+                self.rows.append((group_id, path, similarity))
+                self.offsets.append(self.offsets[-1] + ROW_HEIGHT)
+
+        # Row indexes shifted, so the few materialized rows are rebuilt.
+        for window, frame in self.visible.values():
+            self.canvas.delete(window)
+            frame.destroy()
+        self.visible.clear()
+        self.canvas.delete("message")
+        if not self.rows and self.empty_text:
+            self.canvas.create_text(20, 20, text=self.empty_text, anchor="nw",
+                                    font=('Arial', 12), tags="message")
+        self.canvas.configure(scrollregion=(0, 0, 1, self.offsets[-1]))
+        self._schedule()
+
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        self._schedule()
+
+    def _on_wheel(self, event):
+        if not str(event.widget).startswith(str(self.canvas)):
+            return
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self.canvas.yview_scroll(-1, "units")
+        else:
+            self.canvas.yview_scroll(1, "units")
+        self._schedule()
+
+    def _schedule(self):
+        # Coalesce bursts of scroll events into one refresh.
+        if not self.pending:
+            self.pending = True
+            self.canvas.after_idle(self._refresh)
+
+    def _refresh(self):
+        self.pending = False
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = max(0, bisect_right(self.offsets, top) - 1 - self.overscan)
+        last = min(len(self.rows), bisect_right(self.offsets, bottom) + self.overscan)
+        wanted = range(first, last)
+
+        stale = [i for i in self.visible if i not in wanted]
+        for i in stale:
+            window, frame = self.visible.pop(i)
+            self.canvas.delete(window)
+            frame.destroy()
+        self.thumbnails.cancel(self.rows[i][1] for i in stale if self.rows[i][1] is not None)
+
+        width = self.canvas.winfo_width()
+        for window, _ in self.visible.values():
+            self.canvas.itemconfigure(window, width=width)
+        for i in wanted:
+            if i not in self.visible:
+                frame = self._build(i)
+                window = self.canvas.create_window(0, self.offsets[i], window=frame, anchor="nw",
+                                                   width=width, height=self.offsets[i + 1] - self.offsets[i])
+                self.visible[i] = (window, frame)
+
+    def _build(self, i):
+        group_id, path, value = self.rows[i]
+        if path is None:
+            frame = ttk.Frame(self.canvas, padding=(5, 8, 5, 0))
+            ttk.Label(frame, text=f"Group {group_id} ({value} images)",
+                      font=('Arial', 10, 'bold')).pack(anchor=tk.W)
+            return frame
+
+        frame = ttk.Frame(self.canvas, padding=(15, 2, 5, 2))
+        label = self.make_row(frame, path, value, group_id)
+
+        def show(img, label=label):
+            if not label.winfo_exists():
+                return
+            if img is None:
+                label.config(text="[No Preview]", image="")
+                return
+            photo = ImageTk.PhotoImage(img)
+            label.config(image=photo, text="")
+            label.image = photo  # Keep reference
+
+        img = self.thumbnails.request(path, show)
+        if img is not None:
+            show(img)
+        return frame
@@ -0,0 +1,70 @@
+import functools
+import numpy as np
+import pytest
+from PIL import Image
+import dedupe.engine
+import dedupe.matcher
+from dedupe.engine import ScanEngine
+
+OPTIONS = dict(threshold=90, hash_distance=60, tolerance=20, size=32)
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    """40 groups of a smooth random image and two noisy copies of it."""
+    directory = tmp_path_factory.mktemp("corpus")
+    rng = np.random.default_rng(0)
+    for base in range(40):
+        coarse = rng.integers(0, 256, (4, 4), dtype=np.uint8)
+        pixels = np.asarray(Image.fromarray(coarse).resize((96, 96), Image.BICUBIC), dtype=np.float64)
+        for copy in range(3):
+            noisy = np.clip(pixels + rng.normal(0, 2, pixels.shape), 0, 255).astype(np.uint8)
+            Image.fromarray(noisy).save(directory / f"{base:02d}_{copy}.png")
+    return str(directory)
+
+
+def canonical(groups):
+    return sorted(sorted(path for path, _ in group) for group in groups)
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(dedupe.engine, "iter_duplicate_groups",
+                        functools.partial(dedupe.matcher.iter_duplicate_groups, chunk_size=4))
+
+
+def test_stop_at_any_chunk_then_resume_finds_every_group(corpus, tmp_path, monkeypatch,
+                                                        small_chunks):
+    compare = dedupe.matcher.tiered_similarity
+    chunks = [0]
+
+    def counting_compare(*args, **kwargs):
+        chunks[0] += 1
+        return compare(*args, **kwargs)
+
+    monkeypatch.setattr(dedupe.matcher, "tiered_similarity", counting_compare)
+    expected = canonical(ScanEngine().run(corpus, **OPTIONS))
+    assert len(expected) == 40
+    assert chunks[0] > 10
+
+    for stop_at in range(1, chunks[0] + 1):
+        engine = ScanEngine()
+        calls = [0]
+
+        def stop_during_compare(*args, **kwargs):
+            # Stop while a chunk is being verified, as the GUI's Stop button can.
+            calls[0] += 1
+            if calls[0] == stop_at:
+                engine.stop()
+            return compare(*args, **kwargs)
+
+        monkeypatch.setattr(dedupe.matcher, "tiered_similarity", stop_during_compare)
+        checkpoint = str(tmp_path / f"scan-{stop_at}.jsonl")
+        engine.run(corpus, checkpoint_path=checkpoint, **OPTIONS)
+        monkeypatch.setattr(dedupe.matcher, "tiered_similarity", compare)
+
+        resumed = ScanEngine().run(corpus, checkpoint_path=checkpoint, resume=True, **OPTIONS)
+        assert canonical(resumed) == expected, f"stopped at chunk {stop_at}"
+        # A finished checkpoint replays the same groups.
+        replayed = ScanEngine().run(corpus, checkpoint_path=checkpoint, resume=True, **OPTIONS)
+        assert canonical(replayed) == expected, f"stopped at chunk {stop_at}"
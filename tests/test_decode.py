@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from PIL import Image
+from dedupe.hashers import HASHERS, get_hasher
+from dedupe.indexer import _hash_file
+
+
+def camera_image(seed, size=(4000, 3000)):
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (9, 12, 3), dtype=np.uint8)
+    pixels = np.asarray(Image.fromarray(coarse).resize(size, Image.BICUBIC), dtype=np.float64)
+    noise = rng.normal(0, 4, pixels.shape)
+    return Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+
+
+@pytest.fixture(scope="module")
+def same_image_two_formats(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("formats")
+    pairs = []
+    for seed in range(2):
+        img = camera_image(seed)
+        jpg, png = directory / f"{seed}.jpg", directory / f"{seed}.png"
+        img.save(jpg, quality=92)
+        img.save(png)
+        pairs.append((jpg, png))
+    return pairs
+
+
+@pytest.mark.parametrize("name", sorted(HASHERS))
+@pytest.mark.parametrize("thumb_size", [None, (256, 256)])
+def test_jpeg_and_png_hash_alike_at_camera_resolution(same_image_two_formats, name, thumb_size):
+    # JPEG decodes DCT-scaled, PNG at full size; the hashes must still agree.
+    hasher = get_hasher(name, 256)
+    for jpg, png in same_image_two_formats:
+        h1, _ = _hash_file(str(jpg), thumb_size=thumb_size, hasher=hasher)
+        h2, _ = _hash_file(str(png), thumb_size=thumb_size, hasher=hasher)
+        assert bin(h1 ^ h2).count("1") <= 8
+        if name == "average":
+            assert bin(h1 ^ h2).count("1") <= 5  # the CLI's default --hash-distance
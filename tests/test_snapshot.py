@@ -0,0 +1,33 @@
+import pytest
+from dedupe.records import RecordStore
+from dedupe.snapshot import load_index, save_index
+from dedupe.structures import HASH_INDEXES
+
+
+@pytest.mark.parametrize("kind", sorted(HASH_INDEXES))
+def test_empty_snapshot_round_trip_accepts_inserts(tmp_path, kind):
+    path = tmp_path / "empty.idx"
+    save_index(str(path), RecordStore(), HASH_INDEXES[kind](), settings={"kind": kind})
+
+    records, tree, thumbs, settings = load_index(str(path), verify=True)
+    assert len(records) == 0 and thumbs is None and settings == {"kind": kind}
+    assert tree.search(0, threshold=256) == []
+
+    for i, hash_value in enumerate([0b0, 0b1, 0b11]):
+        record_id = records.append(f"/photos/{i}.jpg", hash_value)
+        tree.add(hash_value, record_id)
+    assert [records.path(i) for i in range(3)] == [f"/photos/{i}.jpg" for i in range(3)]
+    assert sorted(tree.search(0, threshold=1)) == [0, 1]
+
+
+def test_snapshot_without_thumbnails_drops_thumbnail_rows(tmp_path):
+    records = RecordStore(thumb_rows=True)
+    tree = HASH_INDEXES["packed"]()
+    for i, hash_value in enumerate([0b0, 0b1]):
+        tree.add(hash_value, records.append(f"/photos/{i}.jpg", hash_value, row=5 - i))
+    path = tmp_path / "nothumbs.idx"
+    save_index(str(path), records, tree)
+
+    loaded, _, thumbs, _ = load_index(str(path), verify=True)
+    assert thumbs is None and not loaded.thumb_rows
+    assert [record.path for record in loaded] == ["/photos/0.jpg", "/photos/1.jpg"]